@@ -0,0 +1,166 @@
+import re
+from datetime import datetime
+
+import numpy as np
+
+_jsonDate = re.compile(r"^/Date\((-?\d+)[+-]....\)/")
+#Range of dates that datetime, and so _get_Date, can represent
+_minMs = (datetime.min - datetime(1970, 1, 1)).days * 86400000
+_maxMs = (datetime.max - datetime(1970, 1, 1)).days * 86400000 + 86399999
+
+#--------------------------------------------------------------------------------
+class DateDecoder(object):
+    """Decodes WCF JSON dates ("/Date(ms+zzzz)/") a whole list at a time.
+
+       Each distinct JSON date is decoded once, so a decoder shared by the
+       responses of a bundle converts the common Dates only once."""
+
+    def __init__(self):
+        self.cache = {}
+
+    def decode(self, jsonDates, asIndex=False):
+        """Converts a list of JSON dates to 'YYYY-MM-DD' strings, or to a
+           DatetimeIndex if asIndex is True. Invalid dates become None (NaT).
+           The index has second resolution, which holds every date from
+           year 1 to 9999, such as the 9999-12-31 DSWS uses for open ends."""
+        if asIndex:
+            import pandas as pd
+            return pd.DatetimeIndex(self.decode_days(jsonDates).astype('datetime64[s]'))
+        if not jsonDates:
+            return []
+        self._add(jsonDates)
+        cache = self.cache
+        return [cache.get(d) if type(d) is str else None for d in jsonDates]
+
+    def decode_days(self, jsonDates):
+        """Converts a list of JSON dates to a datetime64[D] array"""
+        return np.array(self.decode(jsonDates) if jsonDates else [], dtype='datetime64[D]')
+
+    def convert(self, values):
+        """Returns a copy of values with the JSON date strings converted"""
+        jsonDates = [x for x in values if type(x) is str and '/Date(' in x]
+        if not jsonDates:
+            return list(values)
+        self._add(jsonDates)
+        cache = self.cache
+        return [cache.get(x) if type(x) is str and '/Date(' in x else x for x in values]
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+    def _add(self, jsonDates):
+        #Pull the epoch milliseconds out of the new dates and convert them together
+        cache = self.cache
+        new = [d for d in dict.fromkeys(x for x in jsonDates if type(x) is str) if d not in cache]
+        if not new:
+            return
+        valid = []
+        millis = []
+        for d in new:
+            match = _jsonDate.match(d)
+            ms = int(match.group(1)) if match else None
+            if ms is not None and _minMs <= ms <= _maxMs:
+                valid.append(d)
+                millis.append(ms)
+            else:
+                cache[d] = None
+        days = np.array(millis, dtype=np.int64).astype('datetime64[ms]').astype('datetime64[D]')
+        cache.update(zip(valid, np.datetime_as_string(days, unit='D').tolist()))
+
+#--------------------------------------------------------------------------------
+class ArrayResult(object):
+    """Values of a DataResponse as NumPy arrays, returned by get_data and
+       get_bundle_data with output='numpy'.
+
+       Attributes:
+           dates: datetime64[D] array of the response Dates
+           values: float64 array with a row per date and a column per
+                   instrument and field. Missing values are NaN.
+           instruments, fields: arrays naming the instrument and field of each column
+           currencies: array of the currency of each column, or None
+                   if the request did not ask for currencies
+           errors: dictionary of column position to the error DSWS returned
+           other: dictionary of column position to the values that are not
+                   numbers, such as names or dates"""
+    __slots__ = ['dates', 'values', 'instruments', 'fields', 'currencies', 'errors', 'other']
+
+    def __init__(self, dates, values, instruments, fields, currencies=None, errors=None, other=None):
+        self.dates = dates
+        self.values = values
+        self.instruments = instruments
+        self.fields = fields
+        self.currencies = currencies
+        self.errors = errors if errors else {}
+        self.other = other if other else {}
+
+    def column(self, instrument, field):
+        """Returns the values of instrument and field"""
+        matches = np.flatnonzero((self.instruments == instrument) & (self.fields == field))
+        if not len(matches):
+            raise KeyError((instrument, field))
+        return self.values[:, matches[0]]
+
+    def to_records(self):
+        """Returns a record array with a (Dates, Instrument, Field[, Currency], Value)
+           row per date and column"""
+        nDates, nCols = self.values.shape
+        names = [('Dates', self.dates.dtype), ('Instrument', self.instruments.dtype),
+                 ('Field', self.fields.dtype)]
+        if self.currencies is not None:
+            names.append(('Currency', self.currencies.dtype))
+        names.append(('Value', np.float64))
+        records = np.empty(nDates * nCols, dtype=names).view(np.recarray)
+        #Rows are ordered by column, then date
+        records['Dates'] = np.tile(self.dates, nCols)
+        records['Instrument'] = np.repeat(self.instruments, nDates)
+        records['Field'] = np.repeat(self.fields, nDates)
+        if self.currencies is not None:
+            records['Currency'] = np.repeat(self.currencies, nDates)
+        records['Value'] = self.values.T.ravel()
+        return records
+
+#--------------------------------------------------------------------------------
+#Value types of DSSymbolResponseValueType that hold booleans or numbers
+_numericTypes = {1, 2, 3, 5, 7, 8, 10, 13, 14, 16}
+
+def _is_numeric(values):
+    #Object arrays can hold anything
+    return all(v is None or type(v) in (int, float, bool) for v in values)
+
+def format_arrays(response_json, decoder=None, output='numpy'):
+    """Formats a DataResponse as an ArrayResult, or as its record array if
+       output is 'records', without building pandas objects"""
+    decoder = decoder if decoder else DateDecoder()
+    if 'Dates' not in response_json:
+        return 'Error - please check instruments and parameters (time series or static)'
+    dates = decoder.decode_days(response_json['Dates'])
+    nDates = len(dates)
+    symValues = [(item['DataType'], symVal) for item in response_json['DataTypeValues']
+                 for symVal in item['SymbolValues']]
+    values = np.full((nDates, len(symValues)), np.nan)
+    instruments = []
+    fields = []
+    currencies = []
+    errors = {}
+    other = {}
+    for col, (datatype, symVal) in enumerate(symValues):
+        instruments.append(symVal['Symbol'])
+        fields.append(datatype)
+        if 'Currency' in symVal:
+            currencies.append(symVal['Currency'] if symVal['Currency'] else 'NA')
+        value = symVal['Value']
+        valType = symVal['Type']
+        if valType == 0:
+            errors[col] = value
+        elif valType in _numericTypes or (valType == 12 and isinstance(value, list) and _is_numeric(value)):
+            if isinstance(value, list):
+                if len(value) > nDates:
+                    raise ValueError("Length of values (%d) does not match length of index (%d)"
+                                     % (len(value), nDates))
+                #None becomes NaN
+                values[:len(value), col] = np.array(value, dtype=np.float64)
+            else:
+                values[:, col] = np.nan if value is None else value
+        else:
+            other[col] = decoder.convert(value) if isinstance(value, list) else decoder.convert([value])[0]
+    result = ArrayResult(dates, values, np.array(instruments), np.array(fields),
+                         np.array(currencies) if currencies else None, errors, other)
+    return result.to_records() if output == 'records' else result
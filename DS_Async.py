@@ -0,0 +1,394 @@
+import asyncio
+import functools
+import ssl
+import time
+import traceback
+
+from .DS_Requests import TokenRequest, Properties, DataRequest, loads
+from .DS_Response import Datastream
+from .DS_Token import TokenManager, token_expiry, is_token_error
+from .DS_Transport import DatastreamError
+
+#--------------------------------------------------------------------------------------
+class AsyncDatastream(Datastream):
+    """AsyncDatastream retrieves data from DSWS web rest service with asyncio.
+       Requires aiohttp. The token is requested on the first data call, or
+       with get_token.
+
+           async with AsyncDatastream(username, password) as ds:
+               df = await ds.get_data('VOD', ['P'], start='-1Y')
+
+       get_data, get_bundle_data, update_data and warm_names are awaitable and
+       take the arguments of Datastream, using its cache, store and name cache.
+       iter_bundle_data, get_planned_data and connection_stats are only
+       available on Datastream. The token is not shared through a tokenCache."""
+    #Number of requests in flight at once
+    maxConcurrency = 10
+
+#--------Constructor ---------------------------
+    def __init__(self, username, password, config=None, dataSource=None, proxy=None, sslCer=None,
+                 maxConcurrency=None, bundleSize=None, cache=None, retryPolicy=None, rateLimiter=None,
+                 store=None, metrics=None, nameCache=None):
+        self._set_config(username, password, config, dataSource, proxy, sslCer, None, bundleSize)
+        if maxConcurrency:
+            self.maxConcurrency = maxConcurrency
+        if cache:
+            self.cache = cache
+        if retryPolicy:
+            self.retryPolicy = retryPolicy
+        if rateLimiter:
+            self.rateLimiter = rateLimiter
+        if store:
+            self.store = store
+        if metrics:
+            self.metrics = metrics
+        if nameCache:
+            self.nameCache = nameCache
+        self.tokenResp = None
+        self._session = None
+        self._semaphore = None
+        self._tokenLock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """Closes the connections of the client session"""
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+#-------------------------------------------------------
+#-------------------------------------------------------
+    async def get_token(self, staleToken=None):
+        """Requests a token from DSWS, if there is none or it is about to
+           expire. Concurrent callers share a single GetToken request.
+
+           Args:
+               staleToken: string, default None, a token DSWS rejected. A new
+                           token is requested unless it was already replaced.
+
+           Returns:
+                  Dictionary, the GetToken response"""
+        if self._tokenLock is None:
+            self._tokenLock = asyncio.Lock()
+        async with self._tokenLock:
+            current = self.tokenResp.get('TokenValue') if self.tokenResp else None
+            if staleToken and current and current != staleToken:
+                #Another call has already replaced the rejected token
+                return self.tokenResp
+            if current and not staleToken:
+                expiry = token_expiry(self.tokenResp)
+                if expiry is None or time.time() < expiry - TokenManager.refreshMargin:
+                    return self.tokenResp
+            token_url = self.url + "GetToken"
+            try:
+                propties = []
+                propties.append(Properties("__AppId", self.appID))
+                if self.dataSource:
+                    propties.append(Properties("Source", self.dataSource))
+                tokenReq = TokenRequest(self.username, self.password, propties)
+                raw_tokenReq = tokenReq.get_TokenRequest()
+                self.tokenResp = await self._get_json_Response_async(token_url, raw_tokenReq)
+            except Exception:
+                print("get_token : Exception Occured")
+                print(traceback.sys.exc_info())
+                print(traceback.print_exc(limit=2))
+                self.tokenResp = None
+            return self.tokenResp
+
+    async def get_data(self, tickers, fields=None, start='', end='', freq='', kind=1, dateIndex=False,
+                       useCache=True, timeout=None, output='frame'):
+        """Awaitable version of Datastream.get_data
+
+          Returns:
+                  DataFrame."""
+        getData_url = self.url + "GetData"
+
+        if fields == None:
+            fields = []
+
+        try:
+            retName = False
+            req, retName = self.post_user_request(tickers, fields, start, end, freq, kind, retName)
+            names = None
+            if retName and self.nameCache:
+                #Names the cache holds are not requested again
+                names = self._known_names(req)
+                if names is not None:
+                    req, retName = self._without_names(req), False
+            if self.store and useCache and output == 'frame':
+                df = self.store.get(req, dateIndex)
+                if df is not None:
+                    if self.metrics:
+                        self.metrics.count('storeHits')
+                    self._set_names(df, names)
+                    return df
+            datarequest = DataRequest()
+            dataResponse = None
+            if self.cache:
+                cacheKey = datarequest.encode_Request(req, self.dataSource)
+                if useCache:
+                    dataResponse = self.cache.get(cacheKey)
+                    if self.metrics:
+                        self.metrics.count('cacheMisses' if dataResponse is None else 'cacheHits')
+            if dataResponse is None:
+                json_Response = await self._get_json_Response_token_async(getData_url,
+                                    lambda token: datarequest.encode_Request(req, self.dataSource, token), timeout)
+                if json_Response is None:
+                    return None
+                if 'DataResponse' in json_Response:
+                    dataResponse = json_Response['DataResponse']
+                    if self.cache:
+                        self.cache.set(cacheKey, dataResponse, req)
+                else:
+                    if 'Message' in json_Response:
+                        raise Exception(json_Response['Message'])
+                    return None
+            if retName:
+                names = self._get_metadata(dataResponse)
+            df = await self._run_format(self._format_Response, dataResponse, None, dateIndex, output)
+            if self.store and output == 'frame':
+                self.store.put(req, df)
+            self._set_names(df, names)
+            return df
+        except Exception:
+            print("get_data : Exception Occured")
+            print(traceback.sys.exc_info())
+            print(traceback.print_exc(limit=5))
+            return None
+
+    async def get_bundle_data(self, bundleRequest=None, retName=False, dateIndex=False, useCache=True,
+                              partial=False, timeout=None, output='frame', combine=None):
+        """Awaitable version of Datastream.get_bundle_data. The chunks of a
+           large bundle are posted concurrently, up to maxConcurrency.
+
+            Returns:
+                  List of DataFrames, or a DataFrame with combine."""
+        if bundleRequest == None:
+            bundleRequest = []
+
+        try:
+            from .DS_Arrays import DateDecoder
+            decoder = DateDecoder()
+            if combine:
+                if combine not in ('wide', 'long'):
+                    raise ValueError("combine must be 'wide' or 'long'")
+                output = None
+            bundleRequest, names, formattedResp, missing = self._lookup_bundle(bundleRequest, retName, dateIndex,
+                                                                               useCache, decoder, output)
+            if not missing and (self.cache or self.store) and useCache:
+                return self._finish_bundle(formattedResp, names, combine, dateIndex, decoder)
+            if await self._get_token_value() is None:
+                return None
+
+            async def getChunk(chunk):
+                try:
+                    return await self._get_bundle_chunk_async(chunk, dateIndex, decoder, timeout, output)
+                except Exception as exp:
+                    if not partial:
+                        raise
+                    return self._failed_chunk(exp, chunk)
+            results = await asyncio.gather(*[getChunk(chunk) for chunk in
+                                             self._split_bundle([bundleRequest[pos] for pos in missing])])
+            for pos, df in zip(missing, [df for eachResult in results for df in eachResult]):
+                formattedResp[pos] = df
+                if self.store and output == 'frame':
+                    self.store.put(bundleRequest[pos][0], df)
+            return self._finish_bundle(formattedResp, names, combine, dateIndex, decoder)
+        except Exception:
+            print("get_bundle_data : Exception Occured")
+            print(traceback.sys.exc_info())
+            print(traceback.print_exc(limit=5))
+            return None
+
+    async def update_data(self, data, freq='', end=''):
+        """Awaitable version of Datastream.update_data. The bundles of the
+           different start dates are posted concurrently.
+
+            Returns:
+                  DataFrame or List of DataFrames, as data."""
+        frames = data if isinstance(data, list) else [data]
+        try:
+            updated = list(frames)
+            bundles = self._update_bundles(frames, freq, end)
+            results = await asyncio.gather(*[self.get_bundle_data(bundle) for start, keys, bundle in bundles])
+            for (start, keys, bundle), tails in zip(bundles, results):
+                if tails is None:
+                    raise Exception("Could not get the data from " + start)
+                self._merge_tails(updated, keys, tails)
+            return updated if isinstance(data, list) else updated[0]
+        except Exception:
+            print("update_data : Exception Occured")
+            print(traceback.sys.exc_info())
+            print(traceback.print_exc(limit=5))
+            return None
+
+    async def warm_names(self, tickers, fields=None):
+        """Awaitable version of Datastream.warm_names
+
+            Returns:
+                  Dictionary of SymbolNames and DataTypeNames."""
+        if self.nameCache is None:
+            from .DS_Names import NameCache
+            self.nameCache = NameCache()
+        fields = list(fields) if fields else []
+        try:
+            bundle = self._names_bundle(tickers, fields)
+            if bundle and await self.get_bundle_data(bundle, useCache=False) is None:
+                raise Exception("Could not get the names")
+            return self.nameCache.lookup(tickers, fields)
+        except Exception:
+            print("warm_names : Exception Occured")
+            print(traceback.sys.exc_info())
+            print(traceback.print_exc(limit=5))
+            return None
+
+    def iter_bundle_data(self, *args, **kwargs):
+        """Not available with asyncio, use Datastream.iter_bundle_data"""
+        raise NotImplementedError("iter_bundle_data is only available on Datastream")
+
+    def get_planned_data(self, *args, **kwargs):
+        """Not available with asyncio, use Datastream.get_planned_data"""
+        raise NotImplementedError("get_planned_data is only available on Datastream")
+
+    def connection_stats(self):
+        """Not available with aiohttp, use Datastream.connection_stats"""
+        raise NotImplementedError("connection_stats is only available on Datastream")
+
+#-------------------------------------------------------
+#-------------------------------------------------------
+#-------Helper Functions---------------------------------------------------
+    def _set_config(self, username, password, config=None, dataSource=None, proxy=None, sslCer=None,
+                    maxWorkers=None, bundleSize=None):
+        Datastream._set_config(self, username, password, config, dataSource, proxy, sslCer,
+                               maxWorkers, bundleSize)
+        if config:
+            import configparser
+            parser = configparser.ConfigParser()
+            parser.read(config)
+            self.maxConcurrency = int(parser.get('app', 'maxconcurrency', fallback='').strip() or self.maxConcurrency)
+
+    async def _get_token_value(self):
+        tokenResp = await self.get_token()
+        if (tokenResp == None):
+            raise Exception("Invalid Token Value")
+        elif 'Message' in tokenResp.keys():
+            raise Exception(tokenResp['Message'])
+        return tokenResp.get('TokenValue')
+
+    async def _get_bundle_chunk_async(self, bundleRequest, dateIndex, decoder, timeout=None, output='frame'):
+        """Posts one GetDataBundle request and formats its responses,
+           or returns them as they are if output is None"""
+        getDataBundle_url = self.url + "GetDataBundle"
+        datarequest = DataRequest()
+        json_Response = await self._get_json_Response_token_async(getDataBundle_url,
+                            lambda token: datarequest.encode_bundle_Request(bundleRequest, self.dataSource, token),
+                            timeout)
+        if json_Response is None or 'DataResponses' not in json_Response:
+            raise DatastreamError((json_Response or {}).get('Message', "GetDataBundle returned no DataResponses"),
+                                  200, json_Response, bundleRequest)
+        dataResponses = json_Response['DataResponses']
+        if self.cache:
+            for eachReq, dataResponse in zip(bundleRequest, dataResponses):
+                self.cache.set(datarequest.encode_Request(eachReq[0], self.dataSource), dataResponse, eachReq[0])
+        #Requests with retName or the N hint get their names
+        names = [self._get_metadata(dataResponse) if eachReq[1] else None
+                 for eachReq, dataResponse in zip(bundleRequest, dataResponses)]
+        if output is None:
+            return list(dataResponses)
+        formattedResp = await self._run_format(self._format_bundle_response, json_Response,
+                                               dateIndex, decoder, output)
+        for df, eachNames in zip(formattedResp, names):
+            self._set_names(df, eachNames)
+        return formattedResp
+
+    async def _get_json_Response_token_async(self, reqUrl, build_request, timeout=None):
+        """Posts the request built by build_request(token). If DSWS rejects
+           the token, gets a new one and posts the request once more"""
+        token = await self._get_token_value()
+        if token is None:
+            return None
+        try:
+            json_Response = await self._get_json_Response_async(reqUrl, build_request(token), timeout)
+        except DatastreamError as err:
+            if not is_token_error(err.response):
+                raise
+            json_Response = err.response
+        if is_token_error(json_Response):
+            tokenResp = await self.get_token(token)
+            if tokenResp and tokenResp.get('TokenValue'):
+                json_Response = await self._get_json_Response_async(reqUrl, build_request(tokenResp['TokenValue']),
+                                                                    timeout)
+        return json_Response
+
+    async def _run_format(self, func, *args):
+        #Formatting is CPU bound, so keep it off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args))
+
+    def _get_session(self):
+        import aiohttp
+        if self._session is None:
+            self._load_certs()
+            sslContext = ssl.create_default_context(cafile=self._sslCert if self._sslCert else self.certfile)
+            connector = aiohttp.TCPConnector(limit=self.maxConcurrency, ssl=sslContext)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  headers={'User-Agent': 'DatastreamPy/1.0.11'},
+                                                  timeout=aiohttp.ClientTimeout(total=self._timeout))
+            self._semaphore = asyncio.Semaphore(self.maxConcurrency)
+        return self._session
+
+    async def _get_json_Response_async(self, reqUrl, raw_request, timeout=None):
+        import aiohttp
+        session = self._get_session()
+        proxy = self._proxy['https'] if self._proxy else None
+        #A timeout overrides the one of the session for this request
+        options = {'timeout': aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+        body = self._json_Request(raw_request)
+        metrics = self.metrics
+        started = time.perf_counter() if metrics else 0
+        attempt = 0
+        while True:
+            if metrics:
+                metrics.count('requests')
+                metrics.count('requestBytes', len(body))
+                if attempt:
+                    metrics.count('retries')
+            if self.rateLimiter:
+                await asyncio.sleep(self.rateLimiter.reserve())
+            async with self._semaphore:
+                try:
+                    async with session.post(reqUrl, data=body, proxy=proxy,
+                                            headers={'Content-Type': 'application/json'}, **options) as http_Response:
+                        status = http_Response.status
+                        retryAfter = http_Response.headers.get('Retry-After')
+                        content = await http_Response.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as exp:
+                    if not self.retryPolicy.retry_error(attempt):
+                        raise DatastreamError(str(exp), retryable=True) from exp
+                    status = None
+            if status is None or self.retryPolicy.retry_status(attempt, status):
+                await asyncio.sleep(self.retryPolicy.delay(attempt, None if status is None else retryAfter))
+                attempt += 1
+                continue
+            if metrics:
+                metrics.record('post', time.perf_counter() - started)
+                started = time.perf_counter()
+            try:
+                json_Response = dict(loads(content))
+            except (ValueError, TypeError):
+                json_Response = None
+            if metrics:
+                metrics.record('decode', time.perf_counter() - started)
+                metrics.count('responseBytes', len(content))
+            if status != 200:
+                message = json_Response.get('Message') if json_Response else None
+                raise DatastreamError(message if message else "DSWS returned HTTP status %d" % status,
+                                      status, json_Response, retryable=status in self.retryPolicy.statuses)
+            if json_Response is None:
+                raise DatastreamError("Invalid JSON response", status)
+            return json_Response
@@ -0,0 +1,346 @@
+"""Benchmarks for the response formatting of the Datastream client.
+
+   Responses are generated locally, or served by DS_Stub.StubServer, so no
+   DSWS connection is needed.
+   Run with: python -m <package>.DS_Benchmark"""
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from .DS_Frames import DateDecoder
+from .DS_Requests import DataRequest, dumps, loads
+from .DS_Response import Datastream
+
+#--------------------------------------------------------------------------------
+def json_date(dt):
+    """Formats a datetime as a WCF JSON date"""
+    ms = int((dt - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return "/Date(%d+0000)/" % ms
+
+def make_response(symbols=500, fields=10, dates=250, currency=False, seed=0):
+    """Builds a timeseries DataResponse of doubles with some missing values"""
+    rnd = random.Random(seed)
+    start = datetime(2000, 1, 3)
+    response = {"Dates": [json_date(start + timedelta(days=d)) for d in range(dates)],
+                "DataTypeValues": [], "SymbolNames": None, "DataTypeNames": None,
+                "Tag": None}
+    for f in range(fields):
+        symbolValues = []
+        for s in range(symbols):
+            values = [rnd.random() * 100 for d in range(dates)]
+            values[rnd.randrange(dates)] = None
+            symVal = {"Symbol": "S%05d" % s, "Type": 10, "Value": values}
+            if currency:
+                symVal["Currency"] = "U$"
+            symbolValues.append(symVal)
+        response["DataTypeValues"].append({"DataType": "F%02d" % f,
+                                           "SymbolValues": symbolValues})
+    return response
+
+def _client():
+    #Formatting needs no token, so skip the constructor's GetToken call
+    return Datastream('user', 'password', lazy=True)
+
+def _timeit(func, repeat=3):
+    best = None
+    for r in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None or elapsed < best else best
+    return best, result
+
+#--------------------------------------------------------------------------------
+def legacy_DatatypeValues(ds, jsonResp):
+    """Reference copy of the per-symbol column insertion that
+       _get_DatatypeValues used before ColumnBuilder"""
+    df = pd.DataFrame()
+    multiIndex = False
+    valDict = {"Instrument":[],"Datatype":[],"Value":[],"Currency":[]}
+    for item in jsonResp['DataTypeValues']:
+        datatype = item['DataType']
+        for i in item['SymbolValues']:
+            instrument = i['Symbol']
+            currency = None
+            if 'Currency' in i:
+                currency = i['Currency'] if i['Currency'] else 'NA'
+            valDict["Datatype"].append(datatype)
+            valDict["Instrument"].append(instrument)
+            if currency:
+                valDict['Currency'].append(currency)
+                colNames = (instrument, datatype, currency)
+            else:
+                colNames = (instrument, datatype)
+            values = list(i['Value']) if isinstance(i['Value'], list) else i['Value']
+            valType = i['Type']
+            df[colNames] = None
+            if valType in [7, 8, 10, 11, 12, 13, 14, 15, 16]:
+                rowCount = df.shape[0]
+                valLen = len(values)
+                if rowCount > valLen:
+                    for n in range(rowCount - valLen):
+                        values.append(None)
+                for x in range(0, valLen):
+                    values[x] = ds._get_Date(values[x]) if str(values[x]).find('/Date(') != -1 else values[x]
+                if len(values) > 1:
+                    multiIndex = True
+                    df[colNames] = values
+                else:
+                    multiIndex = False
+                    valDict["Value"].append(values[0])
+            elif valType in [1, 2, 3, 5, 6]:
+                valDict["Value"].append(values)
+                multiIndex = False
+            elif valType == 4:
+                values = ds._get_Date(values) if str(values).find('/Date(') != -1 else values
+                valDict["Value"].append(values)
+                multiIndex = False
+            elif valType == 9:
+                date_array = [ds._get_Date(x) for x in values if str(x).find('/Date(') != -1]
+                if len(values) > 1:
+                    multiIndex = True
+                    df[colNames] = date_array
+                else:
+                    multiIndex = False
+                    valDict["Value"].append(date_array[0])
+            elif valType == 0:
+                valDict["Value"].append(values)
+                df[colNames] = values
+            if multiIndex:
+                if currency:
+                    df.columns = pd.MultiIndex.from_tuples(df.columns, names=['Instrument','Field','Currency'])
+                else:
+                    df.columns = pd.MultiIndex.from_tuples(df.columns, names=['Instrument','Field'])
+    if not multiIndex:
+        indexLen = range(len(valDict['Instrument']))
+        if valDict['Currency']:
+            return pd.DataFrame(data=valDict,columns=["Instrument", "Datatype", "Value", "Currency"],
+                                index=indexLen)
+        return pd.DataFrame(data=valDict,columns=["Instrument", "Datatype", "Value"],
+                            index=indexLen)
+    return df
+
+def bench_wide_response(symbols=500, fields=10, dates=250):
+    """Compares per-symbol column insertion against ColumnBuilder"""
+    ds = _client()
+    response = make_response(symbols, fields, dates)
+    legacyTime, legacy = _timeit(lambda: legacy_DatatypeValues(ds, response), repeat=1)
+    builderTime, built = _timeit(lambda: ds._get_DatatypeValues(response))
+    pd.testing.assert_frame_equal(legacy, built)
+    print("%d symbols x %d fields x %d dates: legacy %.3fs, builder %.3fs (%.1fx)"
+          % (symbols, fields, dates, legacyTime, builderTime, legacyTime / builderTime))
+
+def bench_dates(dates=7500, responses=100):
+    """Compares per-value _get_Date against a DateDecoder shared by a bundle"""
+    ds = _client()
+    jsonDates = make_response(1, 1, dates)["Dates"]
+    legacyTime, legacy = _timeit(lambda: [[ds._get_Date(d) for d in jsonDates]
+                                          for r in range(responses)], repeat=1)
+    def decode():
+        decoder = DateDecoder()
+        return [decoder.decode(jsonDates) for r in range(responses)]
+    decoderTime, decoded = _timeit(decode)
+    assert legacy == decoded
+    print("%d responses x %d dates: _get_Date %.3fs, DateDecoder %.3fs (%.1fx)"
+          % (responses, dates, legacyTime, decoderTime, legacyTime / decoderTime))
+
+def bench_bundle_request(requests=2000):
+    """Compares building and serializing a bundle through dicts and the
+       previous dumps/loads round trip against encode_bundle_Request"""
+    ds = _client()
+    fields = ['P', 'MV', 'PE', 'DY', 'VO']
+    bundle = [ds.post_user_request('S%05d' % i, fields, start='-10Y', freq='D') for i in range(requests)]
+    def legacy():
+        raw = DataRequest().get_bundle_Request(bundle, 'PROD', 'token')
+        #_json_Request round trip, then requests serializes the dict again
+        jsonRequest = json.loads(json.dumps(raw).encode('utf-8'))
+        return json.dumps(jsonRequest).encode('utf-8')
+    legacyTime, legacyBody = _timeit(legacy)
+    encodeTime, body = _timeit(lambda: DataRequest().encode_bundle_Request(bundle, 'PROD', 'token'))
+    assert loads(body) == json.loads(legacyBody)
+    print("%d request bundle: dicts and round trip %.3fs, encode_bundle_Request %.3fs (%.1fx)"
+          % (requests, legacyTime, encodeTime, legacyTime / encodeTime))
+
+def bench_planned_split(jobs=3000, constituents=3):
+    """Measures planning jobs into few requests and splitting their responses
+       back per job, and checks every job gets the SymbolValues of its own
+       instruments, lists (|L) and expressions (|E) included"""
+    from .DS_Planner import RequestPlanner
+    def expand(ticker):
+        #The instruments DSWS returns for a ticker of a job or planned request
+        index = ticker.rfind('|')
+        symbols, hints = (ticker, []) if index == -1 else (ticker[:index], ticker[index + 1:].split(','))
+        if 'L' in hints:
+            return ['%s#%d' % (symbols, c) for c in range(constituents)]
+        return [symbols] if 'E' in hints else symbols.split(',')
+    def respond(spec):
+        return {"Dates": [], "DataTypeValues": [{"DataType": field, "SymbolValues":
+                    [{"Symbol": symbol, "Type": 10, "Value": []} for symbol in expand(spec[0])]}
+                    for field in spec[1] or ['P']], "SymbolNames": None, "DataTypeNames": None, "Tag": None}
+    jobList = [('S%05d' % i, ['P', 'MV'] if i % 3 else ['MV', 'P', 'PE'], '-1Y') for i in range(jobs)]
+    jobList += [('LFTSE100|L', ['P'], '-1Y'), ('LSP500|L', ['P'], '-1Y'),
+                ('PCH#(VOD(P),1Y)|E', ['P'], '-1Y'), ('MAV#(BARC,20D)|E', ['P'], '-1Y'),
+                ('VOD,BARC|C', ['P'], '-1Y')]
+    planTime, plan = _timeit(lambda: RequestPlanner().plan(jobList))
+    responses = [respond(spec) for spec in plan.specs]
+    splitTime, jobResponses = _timeit(lambda: plan.split(responses))
+    for job, jobResp in zip(jobList, jobResponses):
+        assert [item['DataType'] for item in jobResp['DataTypeValues']] == job[1]
+        for item in jobResp['DataTypeValues']:
+            assert [symVal['Symbol'] for symVal in item['SymbolValues']] == expand(job[0])
+    print("%d jobs planned into %d requests: plan %.3fs, split %.3fs"
+          % (len(jobList), len(plan.specs), planTime, splitTime))
+
+def bench_numpy_output(symbols=500, fields=10, dates=250):
+    """Compares formatting a wide daily response to a DataFrame against
+       output='numpy' and output='records'"""
+    import numpy as np
+    ds = _client()
+    response = make_response(symbols, fields, dates)
+    frameTime, frame = _timeit(lambda: ds._format_Response(response))
+    numpyTime, arrays = _timeit(lambda: ds._format_Response(response, output='numpy'))
+    recordsTime, records = _timeit(lambda: ds._format_Response(response, output='records'))
+    assert np.array_equal(frame.to_numpy(dtype=np.float64), arrays.values, equal_nan=True)
+    assert len(records) == symbols * fields * dates
+    print("%d symbols x %d fields x %d dates: DataFrame %.3fs, numpy %.3fs (%.1fx), records %.3fs (%.1fx)"
+          % (symbols, fields, dates, frameTime, numpyTime, frameTime / numpyTime,
+             recordsTime, frameTime / recordsTime))
+
+def bench_typed_output(requests=20, symbols=50, fields=10, dates=500):
+    """Compares the peak memory traced while formatting a bundle of responses
+       with doubles, ints, booleans, strings, dates and errors, and the memory
+       the frames keep, for output='frame' and output='typed'"""
+    import tracemalloc
+    from .DS_Stub import StubServer
+    ds = _client()
+    stub = StubServer(dates=dates, valueTypes=(10, 10, 10, 16, 8, 14, 13, 11, 9, 0))
+    fieldList = ['F%02d' % f for f in range(fields)]
+    responses = []
+    for r in range(requests):
+        req = ds.post_user_request(','.join('S%05d' % (r * symbols + s) for s in range(symbols)),
+                                   fieldList, start='-2Y')
+        response = stub.data_response(loads(DataRequest().encode_Request(req[0]))['DataRequest'])
+        #Parsed JSON does not share values between symbols as the stub does
+        responses.append(loads(dumps(response)))
+    results = {}
+    for output in ('frame', 'typed'):
+        elapsed, frames = _timeit(lambda: ds._format_bundle_response({'DataResponses': responses},
+                                                                     output=output), repeat=1)
+        size = sum(df.memory_usage(deep=True).sum() for df in frames)
+        del frames
+        #A separate pass, as tracing slows the formatting. Arrow backed
+        #string columns are not traced, so the size comes from memory_usage.
+        tracemalloc.start()
+        frames = ds._format_bundle_response({'DataResponses': responses}, output=output)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[output] = (elapsed, peak, size)
+        del frames
+    print("%d requests x %d symbols x %d fields x %d dates: " % (requests, symbols, fields, dates)
+          + ", ".join("%s %.2fs, peak %.0fMB, frames %.0fMB" % (output, elapsed, peak / 1e6, size / 1e6)
+                      for output, (elapsed, peak, size) in results.items()))
+    #Each single value Type is parsed to its own column type, with the values of output='frame'
+    req = ds.post_user_request('S00000,S00001', ['F00'], kind=0)
+    for valType, kind in ((1, 'f'), (2, 'b'), (3, 'i'), (4, 'M'), (5, 'f')):
+        stub = StubServer(staticTypes=(valType,))
+        response = loads(dumps(stub.data_response(loads(DataRequest().encode_Request(req[0]))['DataRequest'])))
+        typed = ds._format_Response(response, output='typed')['Value']
+        assert typed.dtype.kind == kind, (valType, typed.dtype)
+        if kind in 'bi':
+            assert list(typed) == list(ds._format_Response(response)['Value']), valType
+
+def bench_startup(repeat=5):
+    """Times, each in a fresh interpreter, importing DS_Requests and
+       DS_Response, constructing a lazy Datastream and formatting its first
+       response, which includes importing pandas"""
+    import os
+    import subprocess
+    import sys
+    response = json.dumps(make_response(5, 2, 20))
+    steps = [("import DS_Requests", "", "import {pkg}.DS_Requests"),
+             ("import DS_Response", "", "import {pkg}.DS_Response"),
+             ("lazy Datastream()", "from {pkg}.DS_Response import Datastream",
+              "Datastream('user', 'password', lazy=True)"),
+             ("first response", "from {pkg}.DS_Response import Datastream\n"
+              "ds = Datastream('user', 'password', lazy=True)\nresp = json.loads(sys.stdin.read())",
+              "ds._format_Response(resp)")]
+    packageDir = os.path.dirname(os.path.abspath(__file__))
+    template = ("import json, sys, time\n{setup}\nstart = time.perf_counter()\n{step}\n"
+                "print(time.perf_counter() - start)")
+    for name, setup, step in steps:
+        script = template.format(setup=setup, step=step).format(pkg=__package__)
+        times = sorted(float(subprocess.run([sys.executable, '-c', script], input=response, check=True,
+                                            capture_output=True, text=True,
+                                            cwd=os.path.dirname(packageDir)).stdout)
+                       for r in range(repeat))
+        print("%-20s median %.1fms" % (name, times[len(times) // 2] * 1000))
+
+def bench_offline(mode='get_data', calls=50, symbols=20, fields=5, dates=250, valueTypes=None,
+                  workers=1, bundleSize=20):
+    """Measures whole requests through a local DS_Stub.StubServer, running in
+       its own process: throughput, latency percentiles and the peak memory
+       traced while formatting. mode is 'get_data', with a request of symbols
+       x fields per call, or 'bundle', with a bundle of bundleSize of them."""
+    import os
+    import tempfile
+    import tracemalloc
+    from .DS_Stub import StubServer
+    server = StubServer(dates=dates, valueTypes=valueTypes).start(process=True)
+    folder = tempfile.mkdtemp()
+    config = os.path.join(folder, 'Config.ini')
+    with open(config, 'w') as f:
+        f.write("[url]\npath=%s\n[app]\ntimeout=60\nmaxworkers=%d\nbundlesize=%d\n"
+                % (server.url, workers, bundleSize))
+    try:
+        ds = Datastream('user', 'password', config=config)
+        tickers = ','.join('S%05d' % s for s in range(symbols))
+        fieldList = ['F%02d' % f for f in range(fields)]
+        bundle = [ds.post_user_request(tickers, fieldList, start='-1Y') for b in range(bundleSize)]
+        if mode == 'bundle':
+            call = lambda: ds.get_bundle_data(bundle, useCache=False)
+            valuesPerCall = bundleSize * symbols * fields * dates
+        else:
+            call = lambda: ds.get_data(tickers, fieldList, start='-1Y', useCache=False)
+            valuesPerCall = symbols * fields * dates
+        call()
+        latencies = []
+        start = time.perf_counter()
+        for c in range(calls):
+            callStart = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - callStart)
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        ds.close()
+    finally:
+        server.stop()
+        os.remove(config)
+        os.rmdir(folder)
+    latencies.sort()
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    print("%s %d symbols x %d fields x %d dates%s: %.1f calls/s, %.0f values/s, "
+          "p50 %.1fms, p90 %.1fms, p99 %.1fms, peak memory %.1fMB"
+          % (mode, symbols, fields, dates, ' x %d' % bundleSize if mode == 'bundle' else '',
+             calls / elapsed, calls * valuesPerCall / elapsed, percentile(0.5), percentile(0.9),
+             percentile(0.99), peak / 1e6))
+
+#--------------------------------------------------------------------------------
+if __name__ == '__main__':
+    import warnings
+    warnings.simplefilter('ignore', pd.errors.PerformanceWarning)
+    bench_wide_response(50, 10, 250)
+    bench_wide_response(500, 10, 250)
+    bench_dates(7500, 100)
+    bench_bundle_request(2000)
+    bench_numpy_output(500, 10, 250)
+    bench_planned_split(3000)
+    bench_typed_output(20, 50, 10, 500)
+    bench_startup()
+    bench_offline('get_data', 50, 20, 5, 250)
+    bench_offline('bundle', 10, 20, 5, 250, bundleSize=20)
@@ -0,0 +1,175 @@
+import hashlib
+import os
+from abc import ABC, abstractmethod
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from .DS_Requests import dumps, loads
+from .DS_Utils import write_atomic, parse_date
+
+#--------------------------------------------------------------------------------
+class CachePolicy(object):
+    """Time to live, in seconds, of a cached response by the kind of request.
+       A time to live of None keeps the response until it is evicted.
+
+       Args:
+           staticTtl: static requests (kind 0)
+           currentTtl: timeseries that run up to the current date, or whose
+                       start or end date is relative
+           historicalTtl: timeseries between two absolute dates that end
+                       before today"""
+
+    def __init__(self, staticTtl=300, currentTtl=300, historicalTtl=None):
+        self.staticTtl = staticTtl
+        self.currentTtl = currentTtl
+        self.historicalTtl = historicalTtl
+
+    def ttl(self, req):
+        """Returns the time to live of the response to a post_user_request request"""
+        dt = req["Date"]
+        if dt.Kind == 0:
+            return self.staticTtl
+        #Relative or empty dates such as -1Y or LATESTDATE move with time, so
+        #only a request between two absolute dates in the past never changes
+        startDate = parse_date(dt.Start)
+        endDate = parse_date(dt.End)
+        if startDate and endDate and endDate.date() < datetime.now(timezone.utc).date():
+            return self.historicalTtl
+        return self.currentTtl
+
+#--------------------------------------------------------------------------------
+class ResponseCache(ABC):
+    """Base class of the DataResponse caches used by Datastream.
+       Keys are the encoded data requests without the token. A cache
+       implements _get and _set; get and set add the counters and the policy."""
+
+    def __init__(self, policy=None):
+        self.policy = policy if policy else CachePolicy()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached response for key, or None"""
+        response = self._get(key)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def set(self, key, response, req):
+        """Caches the response to the post_user_request request req.
+           Responses with errors are not cached."""
+        if not self._cacheable(response):
+            return
+        ttl = self.policy.ttl(req)
+        if ttl is not None and ttl <= 0:
+            return
+        self._set(key, response, None if ttl is None else time.time() + ttl)
+
+    def stats(self):
+        """Returns the hit and miss counters"""
+        return {'hits': self.hits, 'misses': self.misses}
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+    def _cacheable(self, response):
+        if not isinstance(response, dict) or 'DataTypeValues' not in response:
+            return False
+        for item in response['DataTypeValues'] or []:
+            for symVal in item['SymbolValues']:
+                if symVal['Type'] == 0:
+                    return False
+        return True
+
+    @abstractmethod
+    def _get(self, key):
+        """Returns the response stored for key, or None if there is none or
+           it has expired"""
+
+    @abstractmethod
+    def _set(self, key, response, expires):
+        """Stores response for key until expires, in epoch seconds, or for
+           good if expires is None"""
+
+#--------------------------------------------------------------------------------
+class MemoryCache(ResponseCache):
+    """Least recently used cache of up to maxSize responses in memory"""
+
+    def __init__(self, maxSize=1000, policy=None):
+        ResponseCache.__init__(self, policy)
+        self.maxSize = maxSize
+        self._entries = OrderedDict()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, response = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return response
+
+    def _set(self, key, response, expires):
+        with self._lock:
+            self._entries[key] = (expires, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+
+#--------------------------------------------------------------------------------
+class DiskCache(ResponseCache):
+    """Cache of JSON files in folder. When there are more than maxSize files,
+       the least recently used are removed."""
+
+    def __init__(self, folder, maxSize=None, policy=None):
+        ResponseCache.__init__(self, policy)
+        self.folder = folder
+        self.maxSize = maxSize
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.folder, hashlib.sha1(key).hexdigest() + '.json')
+
+    def _get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if entry['Expires'] is not None and entry['Expires'] < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        #The modification time orders the files for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry['Response']
+
+    def _set(self, key, response, expires):
+        write_atomic(self._path(key), dumps({'Expires': expires, 'Response': response}))
+        if self.maxSize:
+            self._evict()
+
+    def _evict(self):
+        files = [os.path.join(self.folder, name) for name in os.listdir(self.folder)
+                 if name.endswith('.json')]
+        if len(files) <= self.maxSize:
+            return
+        files.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        for path in files[:len(files) - self.maxSize]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
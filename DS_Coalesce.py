@@ -0,0 +1,87 @@
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+from .DS_Requests import DataRequest
+from .DS_Transport import DatastreamError
+
+#--------------------------------------------------------------------------------
+class RequestCoalescer(object):
+    """Shares DSWS requests between threads that call get_data at about the
+       same time through one Datastream client.
+
+       Callers asking for a request that is already in flight wait for its
+       result instead of posting it again. Requests that arrive within
+       window seconds of each other are sent together as one
+       get_bundle_data call, and the DataFrames are handed back per caller.
+
+           coalescer = RequestCoalescer(ds)
+           df = coalescer.get_data('VOD', ['P'], start='-1Y')"""
+
+    def __init__(self, datastream, window=0.02):
+        self.datastream = datastream
+        self.window = window
+        self.calls = 0
+        self.shared = 0
+        self.httpCalls = 0
+        self._inflight = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get_data(self, tickers, fields=None, start='', end='', freq='', kind=1, dateIndex=False):
+        """Same as Datastream.get_data. Each caller gets its own copy of the DataFrame.
+
+          Returns:
+                  DataFrame."""
+        try:
+            req, retName = self.datastream.post_user_request(tickers, fields, start, end, freq, kind)
+            key = (DataRequest().encode_Request(req, self.datastream.dataSource), dateIndex)
+        except Exception:
+            #post_user_request returns None for a malformed request, as get_data does
+            print("RequestCoalescer : Exception Occured")
+            print(traceback.sys.exc_info())
+            return None
+        with self._lock:
+            self.calls += 1
+            future = self._inflight.get(key)
+            if future is not None:
+                self.shared += 1
+                leader = False
+            else:
+                future = self._inflight[key] = Future()
+                batch = self._pending.setdefault(dateIndex, [])
+                batch.append((key, req, retName, future))
+                leader = len(batch) == 1
+        if leader:
+            #The first caller of a window waits for others to join, then sends them all
+            time.sleep(self.window)
+            with self._lock:
+                batch = self._pending.pop(dateIndex)
+            self._send(batch, dateIndex)
+        df = future.result()
+        return df.copy() if hasattr(df, 'copy') else df
+
+    def stats(self):
+        """Returns the number of get_data calls, the HTTP calls made for them
+           and the HTTP calls saved"""
+        with self._lock:
+            return {'calls': self.calls, 'shared': self.shared, 'httpCalls': self.httpCalls,
+                    'saved': self.calls - self.httpCalls}
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+    def _send(self, batch, dateIndex):
+        bundle = [(req, retName) for key, req, retName, future in batch]
+        results = None
+        try:
+            with self._lock:
+                self.httpCalls += len(self.datastream._split_bundle(bundle))
+            results = self.datastream.get_bundle_data(bundle, dateIndex=dateIndex, partial=True)
+        except Exception:
+            print("RequestCoalescer : Exception Occured")
+            print(traceback.sys.exc_info())
+        for pos, (key, req, retName, future) in enumerate(batch):
+            df = results[pos] if results else None
+            with self._lock:
+                del self._inflight[key]
+            future.set_result(None if isinstance(df, DatastreamError) else df)
@@ -0,0 +1,148 @@
+import re
+
+from .DS_Requests import DataRequest, DataType, Date, Instrument, Properties
+from .DS_Utils import parse_date
+
+#--------------------------------------------------------------------------------
+class CompiledRequests(list):
+    """List of (request, retName) pairs compiled by RequestCompiler, ready to
+       pass to get_bundle_data as many times as needed. Each request carries
+       its encoded JSON, so it is not encoded again on every run.
+
+       Attributes:
+           positions: the position in the specs of each request
+           errors: a dictionary per invalid argument, with its position in
+                   the specs, argument name, value and message. Specs with
+                   errors are left out of the list."""
+
+    def __init__(self, requests=(), positions=None, errors=None):
+        list.__init__(self, requests)
+        self.positions = positions if positions else []
+        self.errors = errors if errors else []
+
+#--------------------------------------------------------------------------------
+class RequestCompiler(object):
+    """Parses and validates many (tickers, fields, start, end, freq, kind)
+       specs, the arguments of post_user_request, before anything is sent.
+
+       Instrument hints, datatypes and dates that repeat across the specs are
+       built once and shared by the requests.
+
+           compiled = RequestCompiler().compile(specs)
+           if compiled.errors:
+               print(compiled.errors)
+           frames = ds.get_bundle_data(compiled)"""
+    frequencies = {'', 'D', 'W', 'M', 'Q', 'Y'}
+    #Dates relative to today or to the last date with data, such as -1Y or LATESTDATE
+    dateKeywords = {'BDATE', 'LATESTDATE', 'TODAY', 'YESTERDAY'}
+    relativeDate = re.compile(r'^[+-]?\d+[DWMQY]$', re.IGNORECASE)
+
+    def compile(self, specs):
+        """Compiles specs, tuples of post_user_request arguments. Trailing
+           arguments can be left out.
+
+            Returns:
+                  CompiledRequests"""
+        compiled = CompiledRequests()
+        datarequest = DataRequest()
+        hintCache = {}
+        dtypeCache = {}
+        dateCache = {}
+        dtypeJson = {}
+        dateJson = {}
+        for pos, spec in enumerate(specs):
+            errors = []
+            parsed = self._parse(pos, spec, errors)
+            if errors:
+                compiled.errors.extend(errors)
+                continue
+            symbols, hints, fields, start, end, freq, kind = parsed
+            retName = 'N' in hints
+            props = hintCache.get(hints)
+            if props is None:
+                props = hintCache[hints] = tuple([Properties(hint, True) for hint in hints]) if hints else None
+            dtypes = dtypeCache.get((fields, retName))
+            if dtypes is None:
+                prop = [{'Key': 'ReturnName', 'Value': True}] if retName else None
+                dtypes = dtypeCache[(fields, retName)] = ([DataType(field, prop) for field in fields]
+                                                          if fields else [DataType([], prop)])
+            date = dateCache.get((start, end, freq, kind))
+            if date is None:
+                date = dateCache[(start, end, freq, kind)] = Date(start, freq, end, kind)
+            req = {"Instrument": Instrument(symbols, props), "DataTypes": dtypes, "Date": date}
+            req["Json"] = datarequest._encode_DataRequest(req, dtypeJson, dateJson)
+            compiled.append((req, retName))
+            compiled.positions.append(pos)
+        return compiled
+
+    def check(self, specs):
+        """Returns the errors of specs without compiling them"""
+        errors = []
+        for pos, spec in enumerate(specs):
+            self._parse(pos, spec, errors)
+        return errors
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+    def _parse(self, pos, spec, errors):
+        #Normalised spec, adding a dictionary to errors for each invalid argument
+        if isinstance(spec, str):
+            spec = (spec,)
+        if not 1 <= len(spec) <= 6:
+            errors.append(_error(pos, 'spec', spec, "expected (tickers, fields, start, end, freq, kind)"))
+            return None
+        tickers, fields, start, end, freq, kind = tuple(spec) + (None, '', '', '', 1)[len(spec) - 1:]
+
+        symbols, hints = '', ()
+        if not isinstance(tickers, str) or not tickers.strip():
+            errors.append(_error(pos, 'tickers', tickers, "tickers must be a non-empty string"))
+        else:
+            symbols, bar, hintText = tickers.rpartition('|')
+            if not bar:
+                symbols = hintText
+            else:
+                hints = tuple(hintText.split(','))
+                unknown = [hint for hint in hints if hint not in DataRequest.hints]
+                if unknown:
+                    errors.append(_error(pos, 'tickers', tickers, "unknown instrument hint %s, expected one of %s"
+                                         % (', '.join(map(repr, unknown)), ','.join(sorted(DataRequest.hints)))))
+            if 'E' not in hints and any(not symbol.strip() for symbol in symbols.split(',')):
+                errors.append(_error(pos, 'tickers', tickers, "empty instrument in the ticker list"))
+
+        if fields is None:
+            fields = ()
+        elif isinstance(fields, str):
+            fields = (fields,)
+        if not isinstance(fields, (list, tuple)) or not all(isinstance(f, str) and f.strip() for f in fields):
+            errors.append(_error(pos, 'fields', fields, "fields must be a list of non-empty strings"))
+        else:
+            fields = tuple(fields)
+
+        if not isinstance(freq, str) or freq.upper() not in self.frequencies:
+            errors.append(_error(pos, 'freq', freq, "frequency must be one of %s"
+                                 % ','.join(sorted(f for f in self.frequencies if f))))
+        if kind not in (0, 1):
+            errors.append(_error(pos, 'kind', kind, "kind must be 0 (static) or 1 (timeseries)"))
+        startDate = self._check_date(pos, 'start', start, errors)
+        endDate = self._check_date(pos, 'end', end, errors)
+        if startDate and endDate and startDate > endDate:
+            errors.append(_error(pos, 'end', end, "end date is before the start date " + str(start)))
+        return symbols, hints, fields, start, end, freq, kind
+
+    def _check_date(self, pos, name, value, errors):
+        #Returns the date of an absolute date
+        if not isinstance(value, str):
+            errors.append(_error(pos, name, value, "date must be a string"))
+            return None
+        text = value.strip()
+        if text == '' or text.upper() in self.dateKeywords or self.relativeDate.match(text):
+            return None
+        #Absolute dates are parsed as the cache and the store parse them
+        parsed = parse_date(text)
+        if parsed:
+            return parsed
+        errors.append(_error(pos, name, value, "date must be YYYY-MM-DD, YYYYMMDD, a relative date "
+                                               "such as -1Y, or one of " + ','.join(sorted(self.dateKeywords))))
+        return None
+
+def _error(pos, argument, value, message):
+    return {'position': pos, 'argument': argument, 'value': value, 'message': message}
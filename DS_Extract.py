@@ -0,0 +1,338 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import traceback
+
+import numpy as np
+import pandas as pd
+
+from .DS_Requests import DataRequest, dumps
+from .DS_Utils import write_atomic
+from .DS_Response import Datastream
+
+#--------------------------------------------------------------------------------
+class ProcessExtractor(object):
+    """Gets very large bundles of requests on a pool of processes, so the
+       formatting of the responses is not bound by one interpreter's GIL.
+
+       The token is requested once and handed to every worker. Each worker
+       posts whole bundle chunks and writes each DataFrame to an Arrow IPC
+       file, part-<position>.arrow in folder, which the parent reads back
+       memory mapped instead of unpickling DataFrames. Requires pyarrow.
+
+       A request whose file exists is done: running extract again with the
+       same folder and requests only sends the requests that failed.
+
+           extractor = ProcessExtractor(username, password, processes=8)
+           frames = extractor.extract(bundle, folder='extract')
+           print(extractor.failed)"""
+    processes = 4
+
+    def __init__(self, username, password, config=None, dataSource=None, proxy=None, sslCer=None,
+                 tokenCache=None, processes=None, bundleSize=None):
+        if processes:
+            self.processes = processes
+        self.settings = dict(username=username, password=password, config=config, dataSource=dataSource,
+                             proxy=proxy, sslCer=sslCer, tokenCache=tokenCache, bundleSize=bundleSize)
+        self.failed = []
+        self._stats = {}
+
+    def extract(self, bundleRequest, folder=None, output='frames', dateIndex=False):
+        """Gets the data of the post_user_request requests in bundleRequest.
+
+            Args:
+               bundleRequest: List, expects Datarequests from post_user_request
+               folder: string, default None, the folder of the Arrow files.
+                           A temporary folder is used and removed if None,
+                           unless output is 'dataset'.
+               output: string, default 'frames', a List of DataFrames in the
+                           order of bundleRequest, with None for failed requests.
+                           'merged' returns one DataFrame: the timeseries joined
+                           on their dates, or the static rows stacked.
+                           'dataset' returns the paths of the Arrow files.
+               dateIndex: bool, default False, to be set to True to index
+                           timeseries by a DatetimeIndex instead of date strings
+
+            Returns:
+                  As output. failed lists the (position, message) of each
+                  request that failed."""
+        tempFolder = folder is None and output != 'dataset'
+        folder = folder if folder else tempfile.mkdtemp(prefix='dsextract')
+        ds = None
+        try:
+            start = time.perf_counter()
+            ds = Datastream(lazy=True, **self.settings)
+            os.makedirs(folder, exist_ok=True)
+            if not _check_manifest(folder, bundleRequest, ds.dataSource, 'ProcessExtractor'):
+                return None
+            paths = [_part_path(folder, pos) for pos in range(len(bundleRequest))]
+            missing = [pos for pos in range(len(bundleRequest)) if not os.path.exists(paths[pos])]
+            self.failed = []
+            if missing:
+                #One GetToken for all the workers
+                if not ds._check_token():
+                    return None
+                self._run(ds, bundleRequest, missing, folder, dateIndex)
+            self._stats = {'requests': len(bundleRequest), 'sent': len(missing),
+                           'skipped': len(bundleRequest) - len(missing), 'failed': len(self.failed),
+                           'seconds': time.perf_counter() - start}
+            if output == 'dataset':
+                return [path for path in paths if os.path.exists(path)]
+            frames = [_read_frame(path) if os.path.exists(path) else None for path in paths]
+            return _merge(frames, 'ProcessExtractor') if output == 'merged' else frames
+        except Exception:
+            print("ProcessExtractor.extract : Exception Occured")
+            print(traceback.sys.exc_info())
+            print(traceback.print_exc(limit=5))
+            return None
+        finally:
+            if ds is not None:
+                ds.close()
+            if tempFolder:
+                shutil.rmtree(folder, ignore_errors=True)
+
+    def stats(self):
+        """Returns the requests of the last extract, those sent, those skipped
+           because a previous run got them, those that failed, and its seconds"""
+        return dict(self._stats)
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+    def _run(self, ds, bundleRequest, missing, folder, dateIndex):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        #Chunks are split as get_bundle_data would, one GetDataBundle per task
+        tasks = []
+        pos = 0
+        for chunk in ds._split_bundle([bundleRequest[p] for p in missing]):
+            tasks.append((missing[pos:pos + len(chunk)], chunk))
+            pos += len(chunk)
+        with ProcessPoolExecutor(max_workers=min(self.processes, len(tasks)),
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(self.settings, ds.tokenResp)) as pool:
+            futures = {pool.submit(_extract_chunk, folder, positions, chunk, dateIndex): positions
+                       for positions, chunk in tasks}
+            for future in as_completed(futures):
+                try:
+                    self.failed.extend(future.result())
+                except Exception as exp:
+                    self.failed.extend((pos, str(exp)) for pos in futures[future])
+        self.failed.sort()
+
+#--------------------------------------------------------------------------------
+class BulkJob(object):
+    """Long running download of a list of post_user_request requests that
+       checkpoints each response, so a job that stops part way, because the
+       network or the token failed or the process was restarted, resumes
+       with only the outstanding requests.
+
+       Each DataFrame is written to an Arrow IPC file in folder as soon as
+       its chunk arrives, as ProcessExtractor does. Requires pyarrow.
+
+           job = BulkJob(ds, bundle, 'checkpoint')
+           frames = job.run()
+           #After a failure, run again, in this or a new process
+           print(job.progress())"""
+    #Seconds between progress reports, and failed chunks in a row that stop a run
+    reportEvery = 30
+    stopAfter = 5
+
+    def __init__(self, datastream, bundleRequest, folder):
+        self.datastream = datastream
+        self.bundleRequest = bundleRequest
+        self.folder = folder
+        self.failed = []
+        self._done = 0
+        self._sent = 0
+        self._started = None
+
+    def run(self, dateIndex=False, progress=None, output='frames'):
+        """Gets the outstanding requests, bundleSize x maxWorkers of the
+           Datastream's requests at a time.
+
+            Args:
+               dateIndex: bool, default False, to be set to True to index
+                           timeseries by a DatetimeIndex instead of date strings
+               progress: callable, default None, called with progress() after
+                           each chunk. Without it, progress is printed every
+                           reportEvery seconds.
+               output: string, default 'frames', a List of DataFrames in the
+                           order of the requests, with None for those not done.
+                           'merged' returns one DataFrame and 'dataset' the
+                           paths of the Arrow files, as ProcessExtractor.extract.
+
+            Returns:
+                  As output, or None if the job could not start"""
+        ds = self.datastream
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            if not _check_manifest(self.folder, self.bundleRequest, ds.dataSource, 'BulkJob'):
+                return None
+            paths = [_part_path(self.folder, pos) for pos in range(len(self.bundleRequest))]
+            outstanding = [pos for pos, path in enumerate(paths) if not os.path.exists(path)]
+            self.failed = []
+            self._done = len(paths) - len(outstanding)
+            self._sent = 0
+            self._started = time.perf_counter()
+            reported = self._started
+            failedInRow = 0
+            step = ds.bundleSize * max(1, ds.maxWorkers)
+            for first in range(0, len(outstanding), step):
+                positions = outstanding[first:first + step]
+                frames = ds.get_bundle_data([self.bundleRequest[pos] for pos in positions],
+                                            dateIndex=dateIndex, useCache=False, partial=True)
+                failed = _save_frames(self.folder, positions, frames)
+                self.failed.extend(failed)
+                self._sent += len(positions)
+                self._done += len(positions) - len(failed)
+                failedInRow = failedInRow + 1 if len(failed) == len(positions) else 0
+                if progress:
+                    progress(self.progress())
+                elif time.perf_counter() - reported >= self.reportEvery:
+                    reported = time.perf_counter()
+                    self._report()
+                if failedInRow >= self.stopAfter:
+                    print("BulkJob : stopped after %d failed chunks in a row, run again to resume" % failedInRow)
+                    break
+            if not progress:
+                self._report()
+            if output == 'dataset':
+                return [path for path in paths if os.path.exists(path)]
+            frames = [_read_frame(path) if os.path.exists(path) else None for path in paths]
+            return _merge(frames, 'BulkJob') if output == 'merged' else frames
+        except Exception:
+            print("BulkJob.run : Exception Occured")
+            print(traceback.sys.exc_info())
+            print(traceback.print_exc(limit=5))
+            return None
+
+    def progress(self):
+        """Returns the requests, those done, including by earlier runs, those
+           that failed in this run and those remaining, with the requests per
+           second of this run and the estimated seconds to finish"""
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        rate = self._sent / elapsed if elapsed else 0.0
+        remaining = len(self.bundleRequest) - self._done
+        return {'requests': len(self.bundleRequest), 'done': self._done, 'failed': len(self.failed),
+                'remaining': remaining, 'seconds': elapsed, 'rate': rate,
+                'eta': remaining / rate if rate else (None if remaining else 0.0)}
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+    def _report(self):
+        state = self.progress()
+        eta = time.strftime('%H:%M:%S', time.gmtime(state['eta'])) if state['eta'] is not None else '-'
+        print("BulkJob : %d/%d requests, %d failed, %.1f requests/s, ETA %s"
+              % (state['done'], state['requests'], state['failed'], state['rate'], eta))
+
+#--------------------------------------------------------------------------------
+#The client of each worker process
+_worker = None
+
+def _init_worker(settings, tokenResp):
+    global _worker
+    _worker = Datastream(lazy=True, **settings)
+    #Start from the parent's token; the worker only requests one when it expires
+    _worker.tokenManager.tokenResp = tokenResp
+    _worker.tokenResp = tokenResp
+
+def _extract_chunk(folder, positions, chunk, dateIndex):
+    #Posts one chunk and writes its DataFrames. Returns the failures.
+    frames = _worker.get_bundle_data(chunk, dateIndex=dateIndex, useCache=False, partial=True)
+    return _save_frames(folder, positions, frames)
+
+def _save_frames(folder, positions, frames):
+    #Writes the DataFrames of a chunk and returns the (position, message) of the others
+    if frames is None:
+        return [(pos, 'GetDataBundle failed') for pos in positions]
+    failed = []
+    for pos, df in zip(positions, frames):
+        if isinstance(df, pd.DataFrame):
+            _write_frame(_part_path(folder, pos), df)
+        else:
+            failed.append((pos, str(df)))
+    return failed
+
+def _part_path(folder, pos):
+    return os.path.join(folder, 'part-%06d.arrow' % pos)
+
+def _check_manifest(folder, bundleRequest, dataSource, owner):
+    #A folder only resumes the extract of the same requests
+    datarequest = DataRequest()
+    digest = hashlib.sha1()
+    for eachReq in bundleRequest:
+        digest.update(datarequest.encode_Request(eachReq[0], dataSource))
+    manifest = {'requests': len(bundleRequest), 'digest': digest.hexdigest()}
+    path = os.path.join(folder, 'extract.json')
+    try:
+        with open(path, 'r') as f:
+            if json.load(f) != manifest:
+                print(owner + " : " + folder + " holds the extract of other requests")
+                return False
+        return True
+    except (OSError, ValueError):
+        write_atomic(path, dumps(manifest))
+        return True
+
+def _merge(frames, owner):
+    frames = [df for df in frames if isinstance(df, pd.DataFrame)]
+    if not frames:
+        return None
+    if all(isinstance(df.columns, pd.MultiIndex) for df in frames):
+        return pd.concat(frames, axis=1)
+    if any(isinstance(df.columns, pd.MultiIndex) for df in frames):
+        print(owner + " : timeseries and static frames cannot be merged")
+        return None
+    return pd.concat(frames, axis=0, ignore_index=True)
+
+def _write_frame(path, df):
+    import pyarrow as pa
+    #The columns are stored by position and their labels in the schema metadata,
+    #which reads back faster than pyarrow's pandas metadata
+    layout = {'columns': [list(col) if isinstance(col, tuple) else col for col in df.columns],
+              'names': list(df.columns.names), 'indexed': not isinstance(df.index, pd.RangeIndex),
+              'index': df.index.name}
+    flat = df.set_axis([str(pos) for pos in range(len(df.columns))], axis=1)
+    if layout['indexed']:
+        flat.insert(0, 'index', df.index)
+    try:
+        table = pa.Table.from_pandas(flat, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        #Columns of mixed values, such as numbers and error strings, are kept as JSON,
+        #which holds every value of a DSWS response
+        layout['json'] = []
+        for col in flat.columns:
+            if flat[col].dtype == object:
+                try:
+                    pa.array(flat[col], from_pandas=True)
+                except (pa.ArrowInvalid, pa.ArrowTypeError):
+                    flat[col] = [json.dumps(v, default=str) for v in flat[col]]
+                    layout['json'].append(col)
+        table = pa.Table.from_pandas(flat, preserve_index=False)
+    table = table.replace_schema_metadata({b'dsframe': json.dumps(layout).encode('utf-8')})
+    #A file that exists is complete
+    def write(f):
+        with pa.ipc.new_file(f, table.schema) as writer:
+            writer.write_table(table)
+    write_atomic(path, write)
+
+def _read_frame(path):
+    import pyarrow as pa
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    layout = json.loads(table.schema.metadata[b'dsframe'])
+    df = table.to_pandas(ignore_metadata=True)
+    for col in layout.get('json', []):
+        decoded = np.empty(len(df.index), dtype=object)
+        for pos, text in enumerate(df[col]):
+            decoded[pos] = json.loads(text)
+        df[col] = decoded
+    if layout['indexed']:
+        df = df.set_index('index')
+    df.index.name = layout['index']
+    if len(layout['names']) > 1:
+        df.columns = pd.MultiIndex.from_tuples([tuple(col) for col in layout['columns']], names=layout['names'])
+    else:
+        df.columns = pd.Index(layout['columns'], name=layout['names'][0])
+    return df
@@ -0,0 +1,393 @@
+import numpy as np
+import pandas as pd
+
+#DateDecoder is kept importable from here
+from .DS_Arrays import DateDecoder
+
+#--------------------------------------------------------------------------------
+class ColumnBuilder(object):
+    """Collects the columns of a DataTypeValues response and builds the
+       DataFrame once, instead of inserting into a DataFrame per symbol.
+
+       Columns are set exactly as they would be with df[key] = value, so the
+       row count is fixed by the first array assigned and later arrays must
+       match it."""
+
+    def __init__(self):
+        self.keys = []
+        self.columns = []
+        self.positions = {}
+        self.rowCount = 0
+
+    def set_values(self, key, values):
+        """Sets a column from a list of values"""
+        if len(values) != self.rowCount:
+            if self.rowCount == 0 and len(values) > 0:
+                #Columns set before any rows existed get reindexed at build
+                self.rowCount = len(values)
+            else:
+                raise ValueError("Length of values (%d) does not match length of index (%d)"
+                                 % (len(values), self.rowCount))
+        self._set(key, values if self.rowCount else _Empty(values))
+
+    def set_scalar(self, key, value):
+        """Sets a column with the same value in every row"""
+        self._set(key, _Scalar(value) if self.rowCount else _Empty(value))
+
+    def build(self, names):
+        """Builds the DataFrame with a MultiIndex on the columns"""
+        rowCount = self.rowCount
+        data = {}
+        #Numeric arrays are copied into one preallocated float64 block
+        floatCols = [pos for pos, col in enumerate(self.columns)
+                     if isinstance(col, list) and _is_float_column(col)]
+        block = np.empty((rowCount, len(floatCols)), dtype=np.float64)
+        for j, pos in enumerate(floatCols):
+            block[:, j] = self.columns[pos]
+            self.columns[pos] = block[:, j]
+
+        index = pd.RangeIndex(rowCount)
+        for pos, col in enumerate(self.columns):
+            if isinstance(col, _Scalar):
+                col = col.value
+            elif isinstance(col, _Empty):
+                col = col.reindex(index)
+            data[pos] = col
+        df = pd.DataFrame(data, index=index)
+        df.columns = pd.MultiIndex.from_tuples(self.keys, names=names)
+        return df
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+    def _set(self, key, col):
+        pos = self.positions.get(key)
+        if pos is None:
+            self.positions[key] = len(self.keys)
+            self.keys.append(key)
+            self.columns.append(col)
+        else:
+            self.columns[pos] = col
+
+#--------------------------------------------------------------------------------
+class _Scalar(object):
+    """Value repeated in every row of a column"""
+    __slots__ = ['value']
+
+    def __init__(self, value):
+        self.value = value
+
+class _Empty(object):
+    """Column that was set while the frame had no rows"""
+    __slots__ = ['value']
+
+    def __init__(self, value):
+        self.value = value
+
+    def reindex(self, index):
+        df = pd.DataFrame()
+        df['col'] = self.value
+        return df['col'].reindex(index)
+
+def _is_float_column(values):
+    """True if pandas would infer float64 for the values"""
+    hasFloat = False
+    hasValue = False
+    for v in values:
+        if v is None:
+            hasFloat = True
+        elif type(v) is float:
+            hasFloat = True
+            hasValue = True
+        elif type(v) is int:
+            hasValue = True
+        else:
+            return False
+    return hasFloat and hasValue
+
+#--------------------------------------------------------------------------------
+#Value types of DSSymbolResponseValueType by the column type they are parsed to.
+#Empty (1) has no value and is parsed to a float64 column of NaN.
+_emptyTypes = {1}
+_floatTypes = {5, 10, 16}
+_intTypes = {3, 8, 14}
+_boolTypes = {2, 7, 13}
+_dateTypes = {4, 9, 15}
+_arrayTypes = {7, 8, 9, 10, 11, 12, 13, 14, 15, 16}
+
+def format_typed(response_json, decoder=None, dateIndex=False):
+    """Formats a DataResponse as get_data does, with each column stored in the
+       compact type of its value Type: float64 with NaN for missing values,
+       int64 and bool, or nullable Int64 and boolean if values are missing,
+       datetime64[s] for dates, and categorical for strings that repeat. Errors (Type 0) are not mixed into the data but
+       listed in df.attrs['errors'], a DataFrame of Instrument, Field,
+       [Currency,] Error."""
+    decoder = decoder if decoder else DateDecoder()
+    if 'Dates' not in response_json:
+        return 'Error - please check instruments and parameters (time series or static)'
+    jsonDates = response_json['Dates'] or []
+    nDates = len(jsonDates)
+    keys = []
+    columns = []
+    errors = []
+    currency = False
+    for item in response_json['DataTypeValues']:
+        for symVal in item['SymbolValues']:
+            key = (symVal['Symbol'], item['DataType'])
+            if 'Currency' in symVal:
+                currency = True
+                key += (symVal['Currency'] if symVal['Currency'] else 'NA',)
+            if symVal['Type'] == 0:
+                value = symVal['Value']
+                errors.append(key + (value[0] if isinstance(value, list) and value else value,))
+                continue
+            keys.append(key)
+            columns.append((symVal['Type'], symVal['Value']))
+    names = ['Instrument', 'Field', 'Currency'] if currency else ['Instrument', 'Field']
+
+    if nDates > 1:
+        df = _typed_wide(columns, nDates, decoder)
+        df.columns = pd.MultiIndex.from_tuples(keys, names=names)
+        df.index = decoder.decode(jsonDates, dateIndex)
+        df.index.name = 'Dates'
+    else:
+        #A single date is formatted as a row per instrument and field
+        values = [value[0] if isinstance(value, list) and value else
+                  (None if isinstance(value, list) else value) for valType, value in columns]
+        types = set(valType for valType, value in columns)
+        data = {'Instrument': pd.Categorical([key[0] for key in keys]),
+                'Datatype': pd.Categorical([key[1] for key in keys]),
+                'Value': _typed_values(types.pop() if len(types) == 1 else 12, values, decoder)}
+        if currency:
+            data['Currency'] = pd.Categorical([key[2] for key in keys])
+        df = pd.DataFrame(data, index=pd.RangeIndex(len(keys)))
+        if nDates == 1:
+            df['Dates'] = decoder.decode(jsonDates, dateIndex)[0]
+    df.attrs['errors'] = pd.DataFrame(errors, columns=names + ['Error'])
+    return df
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+def _typed_wide(columns, nDates, decoder):
+    #Doubles are written straight into one float64 block, the other columns are
+    #built separately and put back in their place
+    floatCols = [pos for pos, (valType, value) in enumerate(columns)
+                 if valType in _floatTypes or valType in _emptyTypes]
+    block = np.full((nDates, len(floatCols)), np.nan)
+    for j, pos in enumerate(floatCols):
+        valType, value = columns[pos]
+        if valType in _emptyTypes:
+            continue
+        if isinstance(value, list):
+            if len(value) > nDates:
+                raise ValueError("Length of values (%d) does not match length of index (%d)"
+                                 % (len(value), nDates))
+            block[:len(value), j] = np.array(value, dtype=np.float64)
+        elif value is not None:
+            block[:, j] = value
+    df = pd.DataFrame(block, columns=floatCols, copy=False)
+    others = {}
+    for pos, (valType, value) in enumerate(columns):
+        if valType in _floatTypes or valType in _emptyTypes:
+            continue
+        if not isinstance(value, list) or valType not in _arrayTypes:
+            value = [value] * nDates
+        elif len(value) > nDates:
+            raise ValueError("Length of values (%d) does not match length of index (%d)"
+                             % (len(value), nDates))
+        elif len(value) < nDates:
+            value = value + [None] * (nDates - len(value))
+        others[pos] = _typed_values(valType, value, decoder)
+    if others:
+        df = pd.concat([df, pd.DataFrame(others)], axis=1)
+        df = df[list(range(len(columns)))]
+    return df
+
+def _typed_values(valType, values, decoder):
+    #The values of a column in the compact type of their value Type
+    if valType in _emptyTypes:
+        return np.full(len(values), np.nan)
+    if valType in _floatTypes:
+        return np.array(values, dtype=np.float64)
+    if valType in _intTypes or valType in _boolTypes:
+        #The nullable types only when values are missing, as they add a mask
+        if None not in values:
+            return np.array(values, dtype=np.int64 if valType in _intTypes else np.bool_)
+        return pd.array(values, dtype='Int64' if valType in _intTypes else 'boolean')
+    if valType in _dateTypes:
+        return decoder.decode_days([v if type(v) is str else None for v in values]).astype('datetime64[s]')
+    if all(v is None or type(v) in (int, float) for v in values):
+        return np.array(values, dtype=np.float64)
+    if all(v is None or type(v) is bool for v in values):
+        return pd.array(values, dtype='boolean') if None in values else np.array(values, dtype=np.bool_)
+    if all(v is None or type(v) is str and '/Date(' in v for v in values):
+        return decoder.decode_days(values).astype('datetime64[s]')
+    values = decoder.convert(values)
+    if all(v is None or type(v) is str for v in values) and len(set(values)) * 2 <= len(values):
+        #Strings that repeat, such as currencies or ratings, are stored once
+        return pd.Categorical(values)
+    return np.array(values, dtype=object)
+
+#--------------------------------------------------------------------------------
+def combine_responses(dataResponses, how='wide', dateIndex=False, decoder=None):
+    """Formats the DataResponses of a bundle as one DataFrame, without a
+       DataFrame per response. The union of the responses' dates is taken once
+       and the numbers are written straight into one preallocated block.
+
+       how='wide' returns a frame indexed by the union of the dates with an
+       (Instrument, Field[, Currency]) column per series. how='long' returns
+       a tidy frame of Instrument, Field, [Currency,] Dates, Value rows, with
+       categorical labels.
+       Errors (Type 0) are listed in df.attrs['errors'] as by format_typed."""
+    from .DS_Arrays import _numericTypes, _is_numeric
+    if how not in ('wide', 'long'):
+        raise ValueError("combine must be 'wide' or 'long'")
+    decoder = decoder if decoder else DateDecoder()
+    #The series of all the responses, with the dates of their response
+    series = []
+    errors = []
+    respDates = []
+    currency = False
+    for dataResponse in dataResponses:
+        if 'Dates' not in dataResponse:
+            continue
+        dates = decoder.decode_days(dataResponse['Dates'])
+        respDates.append(dates)
+        for item in dataResponse['DataTypeValues']:
+            for symVal in item['SymbolValues']:
+                key = (symVal['Symbol'], item['DataType'])
+                if 'Currency' in symVal:
+                    currency = True
+                key += (symVal.get('Currency') or 'NA',)
+                value = symVal['Value']
+                if symVal['Type'] == 0:
+                    errors.append(key + (value[0] if isinstance(value, list) and value else value,))
+                    continue
+                if isinstance(value, list) and len(value) > len(dates):
+                    raise ValueError("Length of values (%d) does not match length of index (%d)"
+                                     % (len(value), len(dates)))
+                numeric = symVal['Type'] in _numericTypes or (symVal['Type'] == 12 and isinstance(value, list)
+                                                              and _is_numeric(value))
+                series.append((key, len(respDates) - 1, value, numeric))
+    names = ['Instrument', 'Field', 'Currency'] if currency else ['Instrument', 'Field']
+    width = len(names)
+    if how == 'wide':
+        df = _combine_wide(series, respDates, decoder, dateIndex)
+        df.columns = pd.MultiIndex.from_tuples([key[:width] for key, resp, value, numeric in series], names=names)
+    else:
+        df = _combine_long(series, respDates, decoder, dateIndex, names)
+    df.attrs['errors'] = pd.DataFrame([error[:width] + error[3:] for error in errors], columns=names + ['Error'])
+    return df
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+def _combine_wide(series, respDates, decoder, dateIndex):
+    union = np.unique(np.concatenate(respDates)) if respDates else np.array([], dtype='datetime64[D]')
+    #Row of each response date in the union, found once per response
+    rows = [np.searchsorted(union, dates) for dates in respDates]
+    numericCols = [pos for pos, col in enumerate(series) if col[3]]
+    block = np.full((len(union), len(numericCols)), np.nan)
+    for j, pos in enumerate(numericCols):
+        key, resp, value, numeric = series[pos]
+        if isinstance(value, list):
+            block[rows[resp][:len(value)], j] = np.array(value, dtype=np.float64)
+        elif value is not None:
+            block[rows[resp], j] = value
+    df = pd.DataFrame(block, columns=numericCols, copy=False)
+    others = {}
+    for pos, (key, resp, value, numeric) in enumerate(series):
+        if numeric:
+            continue
+        column = np.full(len(union), None, dtype=object)
+        if isinstance(value, list):
+            column[rows[resp][:len(value)]] = decoder.convert(value)
+        else:
+            column[rows[resp]] = decoder.convert([value])[0]
+        others[pos] = column
+    if others:
+        df = pd.concat([df, pd.DataFrame(others)], axis=1)
+        df = df[list(range(len(series)))]
+    index = union.astype('datetime64[s]')
+    df.index = pd.DatetimeIndex(index) if dateIndex else pd.Index(np.datetime_as_string(union, unit='D'))
+    df.index.name = 'Dates'
+    return df
+
+def _combine_long(series, respDates, decoder, dateIndex, names):
+    #A row per date of each series, in the order of the responses
+    lengths = np.array([len(respDates[resp]) for key, resp, value, numeric in series], dtype=np.int64)
+    total = int(lengths.sum())
+    numeric = all(col[3] for col in series)
+    values = np.full(total, np.nan) if numeric else np.full(total, None, dtype=object)
+    dates = np.empty(total, dtype='datetime64[D]')
+    start = 0
+    for (key, resp, value, isNumeric), length in zip(series, lengths):
+        dates[start:start + length] = respDates[resp]
+        if isinstance(value, list):
+            if numeric:
+                values[start:start + len(value)] = np.array(value, dtype=np.float64)
+            else:
+                values[start:start + len(value)] = value if isNumeric else decoder.convert(value)
+        elif value is not None:
+            values[start:start + length] = value if isNumeric else decoder.convert([value])[0]
+        start += length
+    data = {}
+    for level, name in enumerate(names):
+        #Labels are stored once, with a code per row
+        labels = [key[level] for key, resp, value, isNumeric in series]
+        categories, codes = np.unique(labels, return_inverse=True) if labels else ([], np.array([], dtype=np.int64))
+        data[name] = pd.Categorical.from_codes(np.repeat(codes, lengths), categories)
+    if dateIndex:
+        data['Dates'] = pd.DatetimeIndex(dates.astype('datetime64[s]'))
+    else:
+        #Each distinct date is formatted once
+        union = np.unique(dates)
+        data['Dates'] = pd.Categorical.from_codes(np.searchsorted(union, dates),
+                                                  np.datetime_as_string(union, unit='D'))
+    data['Value'] = values
+    return pd.DataFrame(data, index=pd.RangeIndex(total))
+
+#--------------------------------------------------------------------------------
+def last_dates(df):
+    """Returns the date of the last value of each column of a timeseries
+       DataFrame as 'YYYY-MM-DD'. Columns without values get the first date."""
+    lastDates = {}
+    if len(df.index) == 0:
+        return lastDates
+    for col in df.columns:
+        last = df[col].last_valid_index()
+        last = df.index[0] if last is None else last
+        lastDates[col] = last.strftime('%Y-%m-%d') if hasattr(last, 'strftime') else str(last)
+    return lastDates
+
+def to_wide(df):
+    """Converts the Instrument/Datatype/Value/Dates frame that a single date
+       timeseries response is formatted to into the timeseries layout"""
+    if isinstance(df.columns, pd.MultiIndex) or 'Dates' not in df.columns or len(df.index) == 0:
+        return df
+    keys = ['Instrument', 'Datatype']
+    names = ['Instrument', 'Field']
+    if 'Currency' in df.columns:
+        keys.append('Currency')
+        names.append('Currency')
+    columns = pd.MultiIndex.from_tuples([tuple(row) for row in df[keys].values], names=names)
+    index = pd.Index([df['Dates'].iloc[0]], name='Dates')
+    return pd.DataFrame([list(df['Value'])], index=index, columns=columns).infer_objects()
+
+def merge_tail(df, tail):
+    """Merges the recent dates in tail into the timeseries df. For the columns
+       of tail, the values from its first date replace those in df."""
+    tail = to_wide(tail)
+    if not isinstance(tail.columns, pd.MultiIndex):
+        return df
+    if isinstance(df.index, pd.DatetimeIndex) and not isinstance(tail.index, pd.DatetimeIndex):
+        tail = tail.set_axis(pd.DatetimeIndex(tail.index, name=df.index.name))
+    index = df.index.union(tail.index)
+    index.name = df.index.name
+    merged = df.reindex(index)
+    newCols = tail.columns.difference(df.columns, sort=False)
+    if len(newCols):
+        merged = merged.reindex(columns=df.columns.append(newCols))
+    for col in tail.columns:
+        #Only the dates from the column's own start are replaced
+        colTail = tail[col]
+        first = colTail.first_valid_index()
+        if first is not None:
+            colTail = colTail.loc[first:]
+            merged.loc[colTail.index, col] = colTail.values
+    return merged
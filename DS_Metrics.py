@@ -0,0 +1,130 @@
+import re
+import threading
+
+#--------------------------------------------------------------------------------
+class Metrics(object):
+    """Stage timings and counters of the requests of Datastream clients.
+
+       Stages timed, in seconds:
+           build: encoding the request to JSON bytes
+           post: the HTTP request, including retries and their delays
+           decode: decoding the JSON response
+           format: formatting a DataResponse into a DataFrame or arrays
+
+       Counters: requests, retries, requestBytes, responseBytes,
+       cacheHits, cacheMisses, storeHits, responses, symbols, values.
+
+       Each event is also passed to the hooks, hook(kind, name, value) with
+       kind 'time' or 'count', to forward them to another metrics system.
+       Recording an event takes a lock and a few additions, so the metrics
+       can stay on in production.
+
+           metrics = Metrics()
+           ds = Datastream(username, password, metrics=metrics)
+           print(metrics.to_prometheus())"""
+    stages = ('build', 'post', 'decode', 'format')
+
+    def __init__(self, hooks=None):
+        self.hooks = list(hooks) if hooks else []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def add_hook(self, hook):
+        """Adds a callable hook(kind, name, value) called on every event"""
+        self.hooks.append(hook)
+
+    def record(self, stage, seconds):
+        """Records the time spent in a stage"""
+        with self._lock:
+            timing = self.timings.get(stage)
+            if timing is None:
+                timing = self.timings[stage] = [0, 0.0, 0.0]
+            timing[0] += 1
+            timing[1] += seconds
+            if seconds > timing[2]:
+                timing[2] = seconds
+        for hook in self.hooks:
+            hook('time', stage, seconds)
+
+    def count(self, name, amount=1):
+        """Adds amount to a counter"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        for hook in self.hooks:
+            hook('count', name, amount)
+
+    def snapshot(self):
+        """Returns the counters and, per stage, the count, total and
+           maximum seconds"""
+        with self._lock:
+            return {'timings': {stage: {'count': t[0], 'seconds': t[1], 'max': t[2]}
+                                for stage, t in self.timings.items()},
+                    'counters': dict(self.counters)}
+
+    def reset(self):
+        """Clears the timings and counters"""
+        with self._lock:
+            self.timings = {}
+            self.counters = {}
+
+    def to_prometheus(self, prefix='datastream'):
+        """Returns the metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = ['# TYPE %s_stage_seconds summary' % prefix]
+        for stage, timing in sorted(snapshot['timings'].items()):
+            lines.append('%s_stage_seconds_sum{stage="%s"} %r' % (prefix, stage, timing['seconds']))
+            lines.append('%s_stage_seconds_count{stage="%s"} %d' % (prefix, stage, timing['count']))
+        lines.append('# TYPE %s_stage_seconds_max gauge' % prefix)
+        for stage, timing in sorted(snapshot['timings'].items()):
+            lines.append('%s_stage_seconds_max{stage="%s"} %r' % (prefix, stage, timing['max']))
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = '%s_%s_total' % (prefix, _snake_case(name))
+            lines.append('# TYPE %s counter' % metric)
+            lines.append('%s %d' % (metric, value))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host=''):
+        """Serves to_prometheus at http://host:port/metrics from a daemon
+           thread. Returns the server; call shutdown() on it to stop."""
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        metrics = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), _Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+#--------------------------------------------------------------------------------
+def opentelemetry_hook(meter, prefix='datastream'):
+    """Returns a Metrics hook that records the events with an OpenTelemetry
+       meter: stage timings as a histogram and each counter as a counter.
+
+           metrics.add_hook(opentelemetry_hook(metrics_api.get_meter('dsws')))"""
+    histogram = meter.create_histogram(prefix + '.stage.duration', unit='s',
+                                       description='Time spent in each stage of DSWS requests')
+    counters = {}
+
+    def hook(kind, name, value):
+        if kind == 'time':
+            histogram.record(value, {'stage': name})
+        else:
+            counter = counters.get(name)
+            if counter is None:
+                counter = counters[name] = meter.create_counter(prefix + '.' + _snake_case(name))
+            counter.add(value)
+    return hook
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+def _snake_case(name):
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', name).lower()
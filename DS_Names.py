@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+import time
+
+from .DS_Requests import dumps
+from .DS_Utils import write_atomic
+
+#--------------------------------------------------------------------------------
+class NameCache(object):
+    """Names of instruments and datatypes returned with ReturnName (the N
+       instrument hint or retName), kept for ttl seconds.
+
+       Datastream records the names of every response with ReturnName here,
+       and stops asking DSWS for the names it already holds. With a file,
+       the names are kept across runs and shared by the processes that use it.
+
+           ds = Datastream(username, password, nameCache=NameCache('names.json'))
+           ds.warm_names(universe)
+           df = ds.get_data('VOD,BARC|N', ['P'], start='-1Y')
+           df.attrs['names']"""
+    #Names rarely change, so they are kept for 30 days by default
+    ttl = 30 * 86400
+
+    def __init__(self, file=None, ttl=None):
+        self.file = file
+        if ttl:
+            self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._names = self._read()
+
+    def update(self, names):
+        """Records the names of a structured metadata dictionary, as returned
+           by Datastream._get_metadata"""
+        now = time.time()
+        changed = False
+        with self._lock:
+            for kind in ('SymbolNames', 'DataTypeNames'):
+                entries = self._names.setdefault(kind, {})
+                for code, name in (names.get(kind) or {}).items():
+                    entry = entries.get(code.upper())
+                    #Names seen again within half their ttl are not rewritten
+                    if entry is None or entry[0] != name or entry[1] + self.ttl / 2 < now:
+                        entries[code.upper()] = [name, now]
+                        changed = True
+            if changed:
+                self._write()
+
+    def lookup(self, symbols, datatypes=()):
+        """Returns the fresh names of symbols and datatypes as a metadata
+           dictionary. Codes without a fresh name are left out."""
+        names = {'SymbolNames': {}, 'DataTypeNames': {}}
+        for kind, codes in (('SymbolNames', symbols), ('DataTypeNames', datatypes)):
+            for code in codes:
+                name = self._get(kind, code)
+                if name is not None:
+                    names[kind][code] = name
+        return names
+
+    def missing(self, symbols, datatypes=()):
+        """Returns the symbols and datatypes without a fresh name"""
+        missing = ([code for code in symbols if self._get('SymbolNames', code) is None],
+                   [code for code in datatypes if self._get('DataTypeNames', code) is None])
+        with self._lock:
+            if missing[0] or missing[1]:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return missing
+
+    def stats(self):
+        """Returns the hit and miss counters and the number of names held"""
+        return {'hits': self.hits, 'misses': self.misses,
+                'names': sum(len(entries) for entries in self._names.values())}
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+    def _get(self, kind, code):
+        entry = self._names.get(kind, {}).get(code.upper())
+        if entry is None or entry[1] + self.ttl < time.time():
+            return None
+        return entry[0]
+
+    def _read(self):
+        if not self.file:
+            return {}
+        try:
+            with open(self.file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self):
+        if not self.file:
+            return
+        try:
+            #Names added by other processes since the file was read are kept
+            for kind, entries in self._read().items():
+                current = self._names.setdefault(kind, {})
+                for code, entry in entries.items():
+                    if code not in current or current[code][1] < entry[1]:
+                        current[code] = entry
+            write_atomic(self.file, dumps(self._names))
+        except OSError as exp:
+            print("NameCache : could not write the names: " + str(exp))
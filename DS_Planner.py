@@ -0,0 +1,130 @@
+#--------------------------------------------------------------------------------
+class RequestPlan(object):
+    """Requests planned by RequestPlanner for a list of jobs.
+
+       Attributes:
+           jobs: the normalised (ticker, fields, start, end, freq, kind) jobs
+           specs: post_user_request arguments of each planned request"""
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.specs = []
+        #Per job: a list of (field, [(request, symbol position, field position)]) slots.
+        #A symbol position of None takes all the SymbolValues of the request.
+        self._slots = [[] for job in jobs]
+
+    def split(self, dataResponses):
+        """Splits the DataResponses of the planned requests, in the order of
+           specs, into one DataResponse per job with only its DataTypeValues.
+
+            Returns:
+                  List of DataResponse dictionaries."""
+        jobResponses = []
+        for slots in self._slots:
+            jobResp = None
+            dtValues = []
+            for field, cells in slots:
+                symValues = []
+                for reqIdx, symPos, fieldPos in cells:
+                    dataResponse = dataResponses[reqIdx]
+                    if jobResp is None:
+                        jobResp = dict(dataResponse)
+                    item = dataResponse['DataTypeValues'][fieldPos]
+                    if symPos is None:
+                        symValues.extend(item['SymbolValues'])
+                    else:
+                        symValues.append(item['SymbolValues'][symPos])
+                dtValues.append({'DataType': item['DataType'], 'SymbolValues': symValues})
+            jobResp['DataTypeValues'] = dtValues
+            jobResponses.append(jobResp)
+        return jobResponses
+
+#--------------------------------------------------------------------------------
+class RequestPlanner(object):
+    """Packs (ticker, fields, start, end, freq, kind) jobs into few requests.
+
+       Jobs with the same dates, frequency, kind, instrument hints and set of
+       fields are requested together, with their instruments in one
+       comma separated list. An instrument wanted by several of these jobs
+       is requested once. Requests stay within the server's limits on
+       instruments, datatypes and items per request; Datastream packs them
+       into bundles within its bundleSize and bundleItems."""
+    #Server limits of a single request
+    maxInstruments = 50
+    maxDatatypes = 50
+    maxItems = 100
+
+    def __init__(self, maxInstruments=None, maxDatatypes=None, maxItems=None):
+        if maxInstruments:
+            self.maxInstruments = maxInstruments
+        if maxDatatypes:
+            self.maxDatatypes = maxDatatypes
+        if maxItems:
+            self.maxItems = maxItems
+
+    def plan(self, jobs):
+        """Plans the requests for jobs, tuples of post_user_request arguments
+           (ticker, fields, start, end, freq, kind). Trailing arguments can
+           be left out.
+
+            Returns:
+                  RequestPlan"""
+        jobs = [self._normalise(*job) for job in jobs]
+        plan = RequestPlan(jobs)
+        groups = {}
+        for jobIdx, (ticker, fields, start, end, freq, kind) in enumerate(jobs):
+            index = ticker.rfind('|')
+            symbols, hints = (ticker, '') if index == -1 else (ticker[:index], ticker[index:])
+            if {'L', 'E'} & set(hints[1:].split(',')):
+                #A list expands on the server to an unknown number of symbols, and
+                #an expression can have commas of its own, so each is sent as is
+                groups[(jobIdx,)] = {'fields': fields, 'hints': hints, 'symbols': {symbols: 0},
+                                     'jobs': [(jobIdx, None)]}
+                continue
+            key = (frozenset(fields), hints, start, end, freq, kind)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {'fields': fields, 'hints': hints, 'symbols': {}, 'jobs': []}
+            symPos = [group['symbols'].setdefault(symbol, len(group['symbols']))
+                      for symbol in symbols.split(',')]
+            group['jobs'].append((jobIdx, symPos))
+
+        for key, group in groups.items():
+            self._plan_group(plan, group)
+        return plan
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+    def _normalise(self, ticker, fields=None, start='', end='', freq='', kind=1):
+        if fields is None:
+            fields = []
+        elif isinstance(fields, str):
+            fields = [fields]
+        return (ticker, list(fields), start, end, freq, kind)
+
+    def _plan_group(self, plan, group):
+        ticker, fields, start, end, freq, kind = plan.jobs[group['jobs'][0][0]]
+        #Without fields DSWS returns its default datatype
+        groupFields = fields if fields else [None]
+        fieldsPerRequest = min(self.maxDatatypes, self.maxItems)
+        fieldChunks = [groupFields[i:i + fieldsPerRequest]
+                       for i in range(0, len(groupFields), fieldsPerRequest)]
+        perRequest = max(1, min(self.maxInstruments, self.maxItems // len(fieldChunks[0])))
+        symbols = list(group['symbols'])
+        requests = {}
+        for symChunk in range(0, len(symbols), perRequest):
+            for fieldChunk, chunkFields in enumerate(fieldChunks):
+                requests[(symChunk // perRequest, fieldChunk)] = len(plan.specs)
+                plan.specs.append((','.join(symbols[symChunk:symChunk + perRequest]) + group['hints'],
+                                   [f for f in chunkFields if f is not None], start, end, freq, kind))
+
+        for jobIdx, symPos in group['jobs']:
+            jobFields = plan.jobs[jobIdx][1] or [None]
+            for field in jobFields:
+                fieldPos = groupFields.index(field)
+                fieldChunk, fieldPos = divmod(fieldPos, fieldsPerRequest)
+                if symPos is None:
+                    cells = [(requests[(0, fieldChunk)], None, fieldPos)]
+                else:
+                    cells = [(requests[(pos // perRequest, fieldChunk)], pos % perRequest, fieldPos)
+                             for pos in symPos]
+                plan._slots[jobIdx].append((field, cells))
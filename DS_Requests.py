@@ -4,57 +4,117 @@ Created on Sat Dec 29 00:55:39 2018
 
 @author: Vidya Dinesh
 """
+import json
+
+try:
+    #orjson is used to encode and decode JSON when it is installed
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(obj):
+    """Encodes obj to JSON bytes"""
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+def loads(data):
+    """Decodes JSON bytes or text"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
 #--------------------------------------------------------------------------------
-class Properties(object):
+class _RequestModel(object):
+    """Base of the immutable request models. Their attributes are set once by
+       the constructor, and instances with the same arguments are equal and
+       hash alike, so they can be shared by requests and used as cache and
+       dedup keys. A model's __slots__ are its constructor arguments, in order."""
+    __slots__ = ()
+
+    def _args(self):
+        #The values of the slots identify the instance
+        return tuple([getattr(self, slot) for slot in self.__slots__])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._args() == other._args()
+
+    def __hash__(self):
+        return hash((type(self).__name__,) + self._args())
+
+    def __reduce__(self):
+        return (type(self), self._args())
+
+    def __repr__(self):
+        return "%s%r" % (type(self).__name__, self._args())
+
+#--------------------------------------------------------------------------------
+class Properties(_RequestModel):
     """Properties - Key Value Pair"""
+    __slots__ = ('Key', 'Value')
     
     def __init__(self, key, value):
-        self.Key = key
-        self.Value = value
+        _set = object.__setattr__
+        _set(self, 'Key', key)
+        _set(self, 'Value', value)
         
 #--------------------------------------------------------------------------------      
-class DataType(object):
-    """Class used to store Datatype and its property""" 
-    #datatype = ""
-    #prop = [{'Key': None, 'Value': True}]
+class DataType(_RequestModel):
+    """Class used to store Datatype and its property.
+       A list value is kept as a tuple and the property, a list of
+       {'Key', 'Value'} dictionaries or Properties, as a tuple of Properties."""
+    __slots__ = ('datatype', 'prop')
    
     def __init__(self, value, propty=None, dummy=None):
-       self.datatype = value
+       _set = object.__setattr__
+       _set(self, 'datatype', tuple(value) if isinstance(value, list) else value)
        if propty:
-           self.prop = propty
+           _set(self, 'prop', tuple([eachProp if isinstance(eachProp, Properties)
+                                     else Properties(eachProp['Key'], eachProp['Value'])
+                                     for eachProp in propty]))
        else:
-           self.prop = None
-           #self.prop = [{'Key': None, 'Value': True}]
+           _set(self, 'prop', None)
        
 #--------------------------------------------------------------------------------      
-class Date(object):
+class Date(_RequestModel):
     """Date parameters of a Data Request"""
-    #Start = ""
-    #End = ""
-    #Frequency = ""
-    #Kind = 0
+    __slots__ = ('Start', 'Frequency', 'End', 'Kind')
     
     def __init__(self, startDate = "", freq = "D", endDate = "", kind = 0):
-       self.Start = startDate
-       self.End = endDate
-       self.Frequency = freq
-       self.Kind = kind
+       _set = object.__setattr__
+       _set(self, 'Start', startDate)
+       _set(self, 'End', endDate)
+       _set(self, 'Frequency', freq)
+       _set(self, 'Kind', kind)
 
 #--------------------------------------------------------------------------------                  
-class Instrument(Properties):
-    """Instrument and its Properties"""
-    #instrument = ""
-    properties = [Properties]
+class Instrument(_RequestModel):
+    """Instrument and its Properties, kept as a tuple"""
+    __slots__ = ('instrument', 'properties')
     
     def __init__(self, inst, props):
-        self.instrument = inst
-        self.properties = props
-    
+        _set = object.__setattr__
+        _set(self, 'instrument', inst)
+        _set(self, 'properties', tuple(props) if props else None)
+
 #--------------------------------------------------------------------------------
+def request_key(req):
+    """Returns a hashable key of a request from post_user_request, equal for
+       requests with the same instrument, datatypes and date"""
+    return (req["Instrument"], tuple(req["DataTypes"]), req["Date"])
+    
 #--------------------------------------------------------------------------------
 #--------------------------------------------------------------------------------
 """Classes that help to form the Request in RAW JSON format"""
-class TokenRequest(Properties):
+class TokenRequest(object):
     #password = ""
     #username = ""
     
@@ -105,6 +165,23 @@ class DataRequest:
         self.singleReq["Properties"] = {"Key":"Source","Value":source}
         self.singleReq["TokenValue"] = token
         return self.singleReq
+
+    def encode_bundle_Request(self, reqs, source=None, token=""):
+        """Same request as get_bundle_Request, encoded straight to JSON bytes.
+           The DataTypes and Date of requests that share them are encoded once."""
+        dtypeCache = {}
+        dateCache = {}
+        dataReqs = b','.join([self._encode_DataRequest(eachReq[0], dtypeCache, dateCache)
+                              for eachReq in reqs])
+        return b''.join([b'{"DataRequests":[', dataReqs, b'],"Properties":',
+                         dumps({"Key":"Source","Value":source}), b',"TokenValue":',
+                         dumps(token), b'}'])
+
+    def encode_Request(self, req, source=None, token=""):
+        """Same request as get_Request, encoded straight to JSON bytes"""
+        return b''.join([b'{"DataRequest":', self._encode_DataRequest(req, {}, {}),
+                         b',"Properties":', dumps({"Key":"Source","Value":source}),
+                         b',"TokenValue":', dumps(token), b'}'])
     
 #--------------------HELPER FUNCTIONS--------------------------------------      
     def _set_Datatypes(self, dtypes=None):
@@ -114,7 +191,10 @@ class DataRequest:
             if eachDtype.datatype == None:
                 continue
             else:
-                datatypes.append({"Properties":eachDtype.prop, "Value":eachDtype.datatype})
+                props = [{'Key': eachProp.Key, 'Value': eachProp.Value}
+                         for eachProp in eachDtype.prop] if eachDtype.prop else None
+                value = list(eachDtype.datatype) if isinstance(eachDtype.datatype, tuple) else eachDtype.datatype
+                datatypes.append({"Properties":props, "Value":value})
         return datatypes
             
         
@@ -125,6 +205,26 @@ class DataRequest:
         
     def _set_Date(self, dt):
         return {"End":dt.End,"Frequency":dt.Frequency,"Kind":dt.Kind,"Start":dt.Start}
+
+    def _encode_DataRequest(self, req, dtypeCache, dateCache):
+        """Encodes a DataRequest, reusing the encoded DataTypes and Date in the caches"""
+        #Requests compiled by DS_Compiler.RequestCompiler are encoded already
+        encoded = req.get("Json")
+        if encoded is not None:
+            return encoded
+        dtypes = req["DataTypes"]
+        #The request models hash by value, so they are the cache keys
+        dtypeKey = tuple(dtypes)
+        dtypeJson = dtypeCache.get(dtypeKey)
+        if dtypeJson is None:
+            dtypeJson = dtypeCache[dtypeKey] = dumps(self._set_Datatypes(dtypes))
+        dt = req["Date"]
+        dateJson = dateCache.get(dt)
+        if dateJson is None:
+            dateJson = dateCache[dt] = dumps(self._set_Date(dt))
+        return b''.join([b'{"DataTypes":', dtypeJson, b',"Instrument":',
+                         dumps(self._set_Instrument(req["Instrument"])),
+                         b',"Date":', dateJson, b',"Tag":null}'])
  #--------------------------------------------------------------------------        
     
    
@@ -1,17 +1,31 @@
 
 import requests
 import json
-import pandas as pd
 from datetime import datetime, timedelta
-import pytz
 import traceback
 import platform
 import configparser
 import atexit
 import re
+import time
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+#pandas, pytz and DS_Frames are imported when a response is first formatted,
+#so building requests and clients stays light
+try:
+    #ijson lets iter_bundle_data parse the responses while they are read
+    import ijson
+except ImportError:
+    ijson = None
 
-from .DS_Requests import TokenRequest, Instrument, Properties, DataRequest, DataType, Date
+
+from .DS_Requests import TokenRequest, Instrument, Properties, DataRequest, DataType, Date, dumps, loads
+from .DS_Token import TokenManager, is_token_error
+from .DS_Cache import MemoryCache, DiskCache, CachePolicy
+from .DS_Transport import DatastreamError, RetryPolicy, RateLimiter
+from .DS_Planner import RequestPlanner
 
 #--------------------------------------------------------------------------------------
 class Datastream:
@@ -24,33 +38,114 @@ class Datastream:
     _timeout = 180
     _proxy = None
     _sslCert = None
-    reqSession = requests.Session()
+    #Number of bundle chunks posted concurrently by get_bundle_data
+    maxWorkers = 1
+    #Server limits on the requests and items (instruments x datatypes) in a bundle
+    bundleSize = 20
+    bundleItems = 500
+    tokenCache = None
+    #Each client creates its own session, unless one is set on the class
+    reqSession = None
+    #Hosts with cached connection pools, and connections kept alive per host.
+    #The pool grows to maxWorkers if that is larger.
+    poolConnections = 10
+    poolMaxsize = 10
     appID = "PythonLib-1.0.11"
-    reqSession.headers['User-Agent'] = reqSession.headers['User-Agent'] + ' DatastreamPy/1.0.11'
     certfile = None
+    tokenManager = None
+    #Optional DS_Cache.ResponseCache for DataResponses
+    cache = None
+    #Optional DS_Store.SeriesStore that keeps the DataFrames on disk
+    store = None
+    #Retries of failed requests, and an optional limit on the requests per second
+    retryPolicy = RetryPolicy()
+    rateLimiter = None
+    #Set to True to request the token on the first data call instead of in the constructor
+    lazy = False
+    #Optional DS_Metrics.Metrics that times the stages of each request
+    metrics = None
+    #Optional DS_Names.NameCache; names it holds are not requested again
+    nameCache = None
    
     
 #--------Constructor ---------------------------  
-    def __init__(self, username, password, config=None, dataSource=None, proxy=None, sslCer= None):
+    def __init__(self, username, password, config=None, dataSource=None, proxy=None, sslCer= None,
+                 maxWorkers=None, bundleSize=None, tokenCache=None, cache=None, retryPolicy=None,
+                 rateLimiter=None, store=None, lazy=None, poolConnections=None, poolMaxsize=None,
+                 metrics=None, nameCache=None):
+        self._set_config(username, password, config, dataSource, proxy, sslCer, maxWorkers, bundleSize)
+        if poolConnections:
+            self.poolConnections = poolConnections
+        if poolMaxsize:
+            self.poolMaxsize = poolMaxsize
+        if self.reqSession is None:
+            self.reqSession = self._new_session()
+        if retryPolicy:
+            self.retryPolicy = retryPolicy
+        if rateLimiter:
+            self.rateLimiter = rateLimiter
+        if cache:
+            self.cache = cache
+        if store:
+            self.store = store
+        if lazy is not None:
+            self.lazy = lazy
+        if metrics:
+            self.metrics = metrics
+        if nameCache:
+            self.nameCache = nameCache
+        #tokenCache is a file shared by the processes that use the same credentials
+        if tokenCache:
+            self.tokenCache = tokenCache
+        self.tokenManager = TokenManager(self._get_token, self.tokenCache,
+                                         '|'.join([self.url, username, str(dataSource)]))
+        if not self.lazy:
+            self.tokenResp = self.tokenManager.get()
+        
+    def _set_config(self, username, password, config=None, dataSource=None, proxy=None, sslCer=None,
+                    maxWorkers=None, bundleSize=None):
+        """Sets the url, timeouts and limits from the config file and arguments"""
         if (config):
             parser = configparser.ConfigParser()
             parser.read(config)
             self.url = self.url if parser.get('url','path').strip() == '' else parser.get('url', 'path').strip()
             self.url = self.url.lower()
             if self.url:
-                if re.match("^http:", self.url):
+                #Plain http is only allowed to a server on this machine, such as DS_Stub.StubServer
+                if re.match("^http:", self.url) and not re.match(r"^http://(localhost|127\.\d+\.\d+\.\d+|\[::1\])(:\d+)?(/|$)", self.url):
                     self.url = self.url.replace('http:', 'https:', 1) 
             #self.url = self.url +'/DSWSClient/V1/DSService.svc/rest/'
             self._timeout = 180 if parser.get('app', 'timeout').strip() == '' else int(parser.get('app', 'timeout').strip())
+            self.maxWorkers = int(parser.get('app', 'maxworkers', fallback='').strip() or self.maxWorkers)
+            self.bundleSize = int(parser.get('app', 'bundlesize', fallback='').strip() or self.bundleSize)
+            self.bundleItems = int(parser.get('app', 'bundleitems', fallback='').strip() or self.bundleItems)
+            self.tokenCache = parser.get('app', 'tokencache', fallback='').strip() or self.tokenCache
+            self.poolConnections = int(parser.get('app', 'poolconnections', fallback='').strip() or self.poolConnections)
+            self.poolMaxsize = int(parser.get('app', 'poolmaxsize', fallback='').strip() or self.poolMaxsize)
+            if parser.get('app', 'lazy', fallback='').strip():
+                self.lazy = parser.getboolean('app', 'lazy')
+            if parser.get('app', 'namecache', fallback='').strip():
+                from .DS_Names import NameCache
+                self.nameCache = NameCache(parser.get('app', 'namecache').strip())
+            if parser.get('app', 'store', fallback='').strip():
+                from .DS_Store import SeriesStore
+                self.store = SeriesStore(parser.get('app', 'store').strip())
+            if parser.get('app', 'retries', fallback='').strip():
+                self.retryPolicy = RetryPolicy(retries=int(parser.get('app', 'retries').strip()))
+            if parser.get('app', 'ratelimit', fallback='').strip():
+                self.rateLimiter = RateLimiter(float(parser.get('app', 'ratelimit').strip()))
         self.url = self.url +'/DSWSClient/V1/DSService.svc/rest/'
         if proxy:
             self._proxy = {'http':proxy, 'https':proxy}
         if sslCer:
             self._sslCert = sslCer
+        if maxWorkers:
+            self.maxWorkers = maxWorkers
+        if bundleSize:
+            self.bundleSize = bundleSize
         self.username = username
         self.password = password
         self.dataSource = dataSource
-        self.tokenResp = self._get_token()
         
 #-------------------------------------------------------  
 #------------------------------------------------------- 
@@ -81,6 +176,10 @@ class Datastream:
             else:
                 #Get all the properties of the instrument
                 instprops = []
+                #Unknown hints fail here rather than after the request is sent
+                unknown = [hint for hint in tickers[index+1:].split(',') if hint not in DataRequest.hints]
+                if unknown:
+                    raise ValueError("Unknown instrument hint %s in %s" % (','.join(unknown), tickers))
                 if tickers[index+1:].rfind(',') != -1:
                     propList = tickers[index+1:].split(',')
                     for eachProp in propList:
@@ -114,7 +213,8 @@ class Datastream:
             print(traceback.print_exc(limit=5))
             return None
             
-    def get_data(self, tickers, fields=None, start='', end='', freq='', kind=1):
+    def get_data(self, tickers, fields=None, start='', end='', freq='', kind=1, dateIndex=False,
+                 useCache=True, timeout=None, output='frame'):
         """This Function processes a single JSON format request to provide
            data response from DSWS web in the form of python Dataframe
            
@@ -127,6 +227,18 @@ class Datastream:
                kind: int, default 1, indicates Timeseries as output
                retName: bool, default False, to be set to True if the Instrument
                            names and Datatype names are to be returned
+               dateIndex: bool, default False, to be set to True to index
+                           timeseries by a DatetimeIndex instead of date strings
+               useCache: bool, default True, to be set to False to request the
+                           data from DSWS even if the cache or store has it.
+                           They are still updated with the response.
+               timeout: seconds, default None, overrides the timeout of the
+                           config for this request
+               output: string, default 'frame'. 'typed' returns the
+                           DataFrame with compact column types and the errors
+                           in its attrs['errors'] (see DS_Frames.format_typed).
+                           'numpy' returns a DS_Arrays.ArrayResult of float64
+                           arrays and 'records' a NumPy record array, without pandas
 
           Returns:
                   DataFrame."""
@@ -143,101 +255,642 @@ class Datastream:
         try:
             retName = False
             req, retName = self.post_user_request(tickers, fields, start, end, freq, kind, retName)
+            names = None
+            if retName and self.nameCache:
+                #Names the cache holds are not requested again
+                names = self._known_names(req)
+                if names is not None:
+                    req, retName = self._without_names(req), False
+            if self.store and useCache and output == 'frame':
+                response_dataframe = self.store.get(req, dateIndex)
+                if response_dataframe is not None:
+                    if self.metrics:
+                        self.metrics.count('storeHits')
+                    self._set_names(response_dataframe, names)
+                    return response_dataframe
             datarequest = DataRequest()
-            if (self.tokenResp == None):
-                raise Exception("Invalid Token Value")
-            elif 'Message' in self.tokenResp.keys():
-                raise Exception(self.tokenResp['Message'])
-            elif 'TokenValue' in self.tokenResp.keys():
-               raw_dataRequest = datarequest.get_Request(req, self.dataSource, 
-                                                      self.tokenResp['TokenValue'])
-                #print(raw_dataRequest)
-            if (raw_dataRequest != ""):
-                json_Response = self._get_json_Response(getData_url, raw_dataRequest)
+            dataResponse = None
+            if self.cache:
+                #The request without the token identifies the response
+                cacheKey = datarequest.encode_Request(req, self.dataSource)
+                if useCache:
+                    dataResponse = self.cache.get(cacheKey)
+                    if self.metrics:
+                        self.metrics.count('cacheMisses' if dataResponse is None else 'cacheHits')
+            if dataResponse is None:
+                if not self._check_token():
+                    return None
+                json_Response = self._get_json_Response_token(getData_url,
+                                    lambda token: datarequest.encode_Request(req, self.dataSource, token), timeout)
                 #print(json_Response)
-                #format the JSON response into readable table
                 if 'DataResponse' in json_Response:
-                    if retName:
-                        self._get_metadata(json_Response['DataResponse'])
-                    response_dataframe = self._format_Response(json_Response['DataResponse'])
-                    return response_dataframe
+                    dataResponse = json_Response['DataResponse']
+                    if self.cache:
+                        self.cache.set(cacheKey, dataResponse, req)
                 else:
                     if 'Message' in json_Response:
                         raise Exception(json_Response['Message'])
                     return None
-            else:
-                return None
+            #format the JSON response into readable table
+            if retName:
+                names = self._get_metadata(dataResponse)
+            response_dataframe = self._format_Response(dataResponse, dateIndex=dateIndex, output=output)
+            if self.store and output == 'frame':
+                self.store.put(req, response_dataframe)
+            self._set_names(response_dataframe, names)
+            return response_dataframe
         except Exception:
             print("get_data : Exception Occured")
             print(traceback.sys.exc_info())
             print(traceback.print_exc(limit=5))
             return None
     
-    def get_bundle_data(self, bundleRequest=None, retName=False):
+    def get_bundle_data(self, bundleRequest=None, retName=False, dateIndex=False, useCache=True,
+                        partial=False, timeout=None, output='frame', combine=None):
         """This Function processes a multiple JSON format data requests to provide
            data response from DSWS web in the form of python Dataframe.
            Use post_user_request to form each JSON data request and append to a List
            to pass the bundleRequset.
+           Bundles larger than bundleSize requests or bundleItems items are split
+           into chunks, posted on up to maxWorkers threads. The DataFrames are
+           returned in the order of bundleRequest.
            
             Args:
-               bundleRequest: List, expects list of Datarequests 
+               bundleRequest: List, expects list of Datarequests, or the
+                           CompiledRequests of DS_Compiler.RequestCompiler
                retName: bool, default False, to be set to True if the Instrument
                            names and Datatype names are to be returned
+               dateIndex: bool, default False, to be set to True to index
+                           timeseries by a DatetimeIndex instead of date strings
+               useCache: bool, default True, to be set to False to request the
+                           data from DSWS even if the cache or store has it
+               partial: bool, default False, to be set to True to return the
+                           results of the chunks that succeeded, with a
+                           DatastreamError in place of each failed request.
+                           Its requests attribute lists the requests to send again.
+               timeout: seconds, default None, overrides the timeout of the
+                           config for each chunk
+               output: string, default 'frame', or 'typed', 'numpy' or
+                           'records' as for get_data
+               combine: string, default None. 'wide' returns one DataFrame
+                           with a column per series over the union of the
+                           dates, 'long' one tidy DataFrame of Instrument,
+                           Field, [Currency,] Dates, Value rows, built from
+                           all the responses at once (see
+                           DS_Frames.combine_responses). output and the store
+                           are not used. With partial, df.attrs['failed']
+                           lists the DatastreamErrors of failed requests.
 
             Returns:
-                  DataFrame."""
+                  List of DataFrames, or a DataFrame with combine."""
 
-        getDataBundle_url = self.url + "GetDataBundle"
-        raw_dataRequest = ""
-        json_dataRequest = ""
-        json_Response = ""
-       
         if bundleRequest == None:
             bundleRequest = []
         
         try:
-            datarequest = DataRequest()
-            if (self.tokenResp == None):
-                raise Exception("Invalid Token Value")
-            elif 'Message' in self.tokenResp.keys():
-                raise Exception(self.tokenResp['Message'])
-            elif 'TokenValue' in self.tokenResp.keys():
-                raw_dataRequest = datarequest.get_bundle_Request(bundleRequest, self.dataSource, 
-                                                             self.tokenResp['TokenValue'])
-            #print(raw_dataRequest)
-            if (raw_dataRequest != ""):
-                 json_Response = self._get_json_Response(getDataBundle_url, raw_dataRequest)
-                     #print(json_Response)
-                 if 'DataResponses' in json_Response:
-                     if retName:
-                         self._get_metadata_bundle(json_Response['DataResponses'])
-                     response_dataframe = self._format_bundle_response(json_Response)
-                     return response_dataframe
-                 else:
-                    if 'Message' in json_Response:
-                        raise Exception(json_Response['Message'])
-                    return None
-            else:
+            from .DS_Arrays import DateDecoder
+            #Dates repeated across the chunks are decoded once
+            decoder = DateDecoder()
+            if combine:
+                if combine not in ('wide', 'long'):
+                    raise ValueError("combine must be 'wide' or 'long'")
+                #The DataResponses are kept and formatted together at the end
+                output = None
+            bundleRequest, names, formattedResp, missing = self._lookup_bundle(bundleRequest, retName, dateIndex,
+                                                                               useCache, decoder, output)
+            if not missing and (self.cache or self.store) and useCache:
+                return self._finish_bundle(formattedResp, names, combine, dateIndex, decoder)
+
+            if not self._check_token():
                 return None
+
+            chunks = self._split_bundle([bundleRequest[pos] for pos in missing])
+            def getChunk(chunk):
+                try:
+                    return self._get_bundle_chunk(chunk, False, dateIndex, decoder, timeout, output)
+                except Exception as exp:
+                    if not partial:
+                        raise
+                    return self._failed_chunk(exp, chunk)
+            if len(chunks) > 1 and self.maxWorkers > 1:
+                #Each chunk is parsed on its worker thread as soon as it arrives
+                with ThreadPoolExecutor(max_workers=min(self.maxWorkers, len(chunks))) as pool:
+                    results = list(pool.map(getChunk, chunks))
+            else:
+                results = [getChunk(chunk) for chunk in chunks]
+
+            for pos, df in zip(missing, [df for eachResult in results for df in eachResult]):
+                formattedResp[pos] = df
+                if self.store and output == 'frame':
+                    self.store.put(bundleRequest[pos][0], df)
+            return self._finish_bundle(formattedResp, names, combine, dateIndex, decoder)
         except Exception:
             print("get_bundle_data : Exception Occured")
             print(traceback.sys.exc_info())
             print(traceback.print_exc(limit=5))
             return None
     
+    def update_data(self, data, freq='', end=''):
+        """This Function brings timeseries DataFrames from get_data or
+           get_bundle_data up to date. For each instrument and field, only the
+           dates from its last value onwards are requested. Instruments that
+           share a start date are requested in one bundle. The last stored
+           value is requested again, so revisions to it are picked up.
+
+            Args:
+               data: DataFrame or List of DataFrames, timeseries with
+                           (Instrument, Field[, Currency]) columns
+               freq : string, default '', the frequency the data was requested with
+               end : string, default ''
+
+            Returns:
+                  DataFrame or List of DataFrames, as data. Frames that are
+                  not timeseries are returned unchanged."""
+        frames = data if isinstance(data, list) else [data]
+        try:
+            updated = list(frames)
+            for start, keys, bundle in self._update_bundles(frames, freq, end):
+                tails = self.get_bundle_data(bundle)
+                if tails is None:
+                    raise Exception("Could not get the data from " + start)
+                self._merge_tails(updated, keys, tails)
+            return updated if isinstance(data, list) else updated[0]
+        except Exception:
+            print("update_data : Exception Occured")
+            print(traceback.sys.exc_info())
+            print(traceback.print_exc(limit=5))
+            return None
+
+    def iter_bundle_data(self, bundleRequest=None, retName=False, dateIndex=False, timeout=None):
+        """This Function is a generator version of get_bundle_data that yields
+           (request, DataFrame) pairs one response at a time, so only a few
+           chunks are held in memory. bundleRequest can itself be a generator.
+           The next chunk is requested while the current one is formatted.
+           With ijson installed, responses are parsed as the body is read.
+           
+            Args:
+               bundleRequest: List or iterable, expects Datarequests from
+                           post_user_request
+               retName: bool, default False, to be set to True if the Instrument
+                           names and Datatype names are to be returned
+               dateIndex: bool, default False, to be set to True to index
+                           timeseries by a DatetimeIndex instead of date strings
+               timeout: seconds, default None, overrides the timeout of the
+                           config for each chunk
+
+            Yields:
+                  (request, DataFrame). Raises an Exception if a chunk fails."""
+        if bundleRequest == None:
+            bundleRequest = []
+        if not self._check_token():
+            return
+        from .DS_Arrays import DateDecoder
+        decoder = DateDecoder()
+        chunks = self._iter_chunks(bundleRequest)
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as pool:
+            pending = deque((chunk, pool.submit(self._get_bundle_responses, chunk, timeout))
+                            for chunk in itertools.islice(chunks, self.maxWorkers))
+            responses = None
+            try:
+                while pending:
+                    chunk, future = pending.popleft()
+                    responses = future.result()
+                    for nextChunk in itertools.islice(chunks, 1):
+                        pending.append((nextChunk, pool.submit(self._get_bundle_responses, nextChunk, timeout)))
+                    count = 0
+                    for eachReq, dataResponse in zip(chunk, responses):
+                        count += 1
+                        names = self._get_metadata(dataResponse) if retName or eachReq[1] else None
+                        df = self._format_Response(dataResponse, decoder, dateIndex)
+                        self._set_names(df, names)
+                        yield eachReq, df
+                    if hasattr(responses, 'close'):
+                        responses.close()
+                    if count != len(chunk):
+                        raise Exception("GetDataBundle returned %d of %d responses" % (count, len(chunk)))
+            finally:
+                #If the consumer stops early, the streamed responses still open are closed
+                if hasattr(responses, 'close'):
+                    responses.close()
+                for chunk, future in pending:
+                    if future.cancel():
+                        continue
+                    try:
+                        result = future.result()
+                    except Exception:
+                        continue
+                    if hasattr(result, 'close'):
+                        result.close()
+
+    def get_planned_data(self, jobs, dateIndex=False, useCache=True, timeout=None, planner=None):
+        """This Function gets the data of many (ticker, fields, start, end, freq, kind)
+           jobs in as few requests as possible. RequestPlanner groups the jobs
+           that share dates and fields into requests with comma separated
+           instrument lists, which are posted in bundles. Each job gets the
+           DataFrame that get_data would return for it.
+
+            Args:
+               jobs: List of tuples of get_data arguments
+                           (tickers, fields, start, end, freq, kind)
+               dateIndex: bool, default False, to be set to True to index
+                           timeseries by a DatetimeIndex instead of date strings
+               useCache: bool, default True, to be set to False to request the
+                           data from DSWS even if the cache has it
+               timeout: seconds, default None, overrides the timeout of the
+                           config for each bundle
+               planner: RequestPlanner, default None, to change the limits
+                           of each request
+
+            Returns:
+                  List of DataFrames, one per job. Jobs with the N hint have
+                  their names in df.attrs['names']."""
+        try:
+            plan = (planner if planner else RequestPlanner()).plan(jobs)
+            bundle = [self.post_user_request(*spec) for spec in plan.specs]
+            dataResponses = [None] * len(bundle)
+            missing = list(range(len(bundle)))
+            if self.cache and useCache:
+                datarequest = DataRequest()
+                missing = []
+                for pos, eachReq in enumerate(bundle):
+                    dataResponses[pos] = self.cache.get(datarequest.encode_Request(eachReq[0], self.dataSource))
+                    if self.metrics:
+                        self.metrics.count('cacheMisses' if dataResponses[pos] is None else 'cacheHits')
+                    if dataResponses[pos] is None:
+                        missing.append(pos)
+
+            if missing:
+                if not self._check_token():
+                    return None
+                chunks = self._split_bundle([bundle[pos] for pos in missing])
+                post = lambda chunk: self._post_bundle(chunk, timeout)
+                if len(chunks) > 1 and self.maxWorkers > 1:
+                    with ThreadPoolExecutor(max_workers=min(self.maxWorkers, len(chunks))) as pool:
+                        results = list(pool.map(post, chunks))
+                else:
+                    results = [post(chunk) for chunk in chunks]
+                for pos, dataResponse in zip(missing, [r for eachResult in results for r in eachResult]):
+                    dataResponses[pos] = dataResponse
+
+            #The names of the planned requests are shared out to the jobs with the N hint
+            names = {'SymbolNames': {}, 'DataTypeNames': {}}
+            for (req, retName), dataResponse in zip(bundle, dataResponses):
+                if retName:
+                    for kind, reqNames in self._get_metadata(dataResponse).items():
+                        names[kind].update(reqNames)
+            from .DS_Arrays import DateDecoder
+            decoder = DateDecoder()
+            frames = []
+            for job, jobResp in zip(plan.jobs, plan.split(dataResponses)):
+                df = self._format_Response(jobResp, decoder, dateIndex)
+                index = job[0].rfind('|')
+                if index != -1 and 'N' in job[0][index+1:].split(','):
+                    symbols = set(symVal['Symbol'] for item in jobResp['DataTypeValues'] for symVal in item['SymbolValues'])
+                    fields = set(item['DataType'] for item in jobResp['DataTypeValues'])
+                    self._set_names(df, {'SymbolNames': {code: name for code, name in names['SymbolNames'].items()
+                                                         if code in symbols},
+                                         'DataTypeNames': {code: name for code, name in names['DataTypeNames'].items()
+                                                           if code in fields}})
+                frames.append(df)
+            return frames
+        except Exception:
+            print("get_planned_data : Exception Occured")
+            print(traceback.sys.exc_info())
+            print(traceback.print_exc(limit=5))
+            return None
+
+    def warm_names(self, tickers, fields=None):
+        """This Function fills the name cache with the names of a universe of
+           instruments, and of fields, in one bundled call. Only the names the
+           cache does not hold are requested, with as many instruments per
+           request as the server allows.
+
+            Args:
+               tickers: List of instrument codes
+               fields: List, default None, datatypes whose names are wanted too
+
+            Returns:
+                  Dictionary of SymbolNames and DataTypeNames, each a
+                  dictionary of code to name, as the name cache holds them."""
+        if self.nameCache is None:
+            from .DS_Names import NameCache
+            self.nameCache = NameCache()
+        fields = list(fields) if fields else []
+        try:
+            bundle = self._names_bundle(tickers, fields)
+            if bundle and self.get_bundle_data(bundle, useCache=False) is None:
+                raise Exception("Could not get the names")
+            return self.nameCache.lookup(tickers, fields)
+        except Exception:
+            print("warm_names : Exception Occured")
+            print(traceback.sys.exc_info())
+            print(traceback.print_exc(limit=5))
+            return None
+
+    def connection_stats(self):
+        """Returns the number of HTTP requests sent through the connection
+           pool of this client, the connections it opened for them and the
+           requests that reused an open connection"""
+        sentRequests = 0
+        connections = 0
+        #The same adapter is mounted for http and https
+        for adapter in set(self.reqSession.adapters.values()):
+            pools = getattr(getattr(adapter, 'poolmanager', None), 'pools', None)
+            if pools is None:
+                continue
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    sentRequests += pool.num_requests
+                    connections += pool.num_connections
+        return {'requests': sentRequests, 'connections': connections,
+                'reused': max(0, sentRequests - connections)}
+
+    def close(self):
+        """Closes the connections of the client's session"""
+        if self.reqSession is not None:
+            self.reqSession.close()
+
 #------------------------------------------------------- 
 #-------------------------------------------------------             
 #-------Helper Functions---------------------------------------------------
-    def _get_Response(self, reqUrl, raw_request):
+    def _split_bundle(self, bundleRequest):
+        """Splits the requests into chunks within bundleSize and bundleItems"""
+        return list(self._iter_chunks(bundleRequest)) or [[]]
+
+    def _iter_chunks(self, bundleRequest):
+        chunk = []
+        chunkItems = 0
+        for eachReq in bundleRequest:
+            req = eachReq[0]
+            items = len(req["DataTypes"]) * (req["Instrument"].instrument.count(',') + 1)
+            if chunk and (len(chunk) >= self.bundleSize or chunkItems + items > self.bundleItems):
+                yield chunk
+                chunk = []
+                chunkItems = 0
+            chunk.append(eachReq)
+            chunkItems += items
+        if chunk:
+            yield chunk
+
+    def _get_bundle_responses(self, bundleRequest, timeout=None):
+        """Posts one GetDataBundle request and returns its DataResponses. With
+           ijson, they are returned by a generator that parses the body as it is read."""
+        if ijson is None:
+            return self._post_bundle(bundleRequest, timeout)
+        getDataBundle_url = self.url + "GetDataBundle"
+        datarequest = DataRequest()
+        build_request = lambda token: datarequest.encode_bundle_Request(bundleRequest, self.dataSource, token)
+        #As _get_json_Response_token: a rejected token is renewed and the request posted once more
+        token = self.tokenResp['TokenValue']
+        try:
+            responses, json_Response = self._stream_bundle(getDataBundle_url,
+                                                           self._build_request(build_request, token), timeout)
+        except DatastreamError as err:
+            if not (self.tokenManager and is_token_error(err.response)):
+                raise
+            responses, json_Response = None, err.response
+        if responses is None and self.tokenManager and is_token_error(json_Response):
+            tokenResp = self.tokenManager.refresh(token)
+            if tokenResp and 'TokenValue' in tokenResp:
+                self.tokenResp = tokenResp
+                responses, json_Response = self._stream_bundle(getDataBundle_url,
+                                                               self._build_request(build_request, tokenResp['TokenValue']),
+                                                               timeout)
+        if responses is None:
+            if 'DataResponses' not in json_Response:
+                raise DatastreamError(json_Response.get('Message', "GetDataBundle returned no DataResponses"),
+                                      200, json_Response, bundleRequest)
+            responses = json_Response['DataResponses']
+        return self._cache_responses(bundleRequest, responses)
+
+    def _stream_bundle(self, reqUrl, raw_request, timeout=None):
+        """Posts a GetDataBundle request and returns (DataResponses generator,
+           None) if the body starts with DataResponses, else (None, the decoded
+           JSON response) as _get_json_Response returns it"""
+        try:
+            http_Response = self._get_Response(reqUrl, raw_request, stream=True, timeout=timeout)
+        except requests.exceptions.RequestException as exp:
+            raise DatastreamError(str(exp), retryable=True) from exp
+        http_Response.raw.decode_content = True
+        body = _BodyReader(http_Response.raw)
+        if http_Response.status_code == 200 and body.starts_with(_dataResponsesStart):
+            return _ClosingResponses(self._stream_responses(http_Response, body), http_Response), None
+        try:
+            content = body.read()
+        finally:
+            http_Response.close()
+        return None, self._decode_json_Response(http_Response, content)
+
+    def _stream_responses(self, http_Response, body):
+        decodeTime = 0.0
         try:
-            #convert raw request to json format before post
+            items = ijson.items(body, 'DataResponses.item', use_float=True)
+            while True:
+                started = time.perf_counter()
+                dataResponse = next(items, None)
+                decodeTime += time.perf_counter() - started
+                if dataResponse is None:
+                    break
+                yield dataResponse
+        finally:
+            http_Response.close()
+            if self.metrics:
+                self.metrics.record('decode', decodeTime)
+                self.metrics.count('responseBytes', body.size)
+
+    def _cache_responses(self, bundleRequest, responses):
+        #Stores each DataResponse in the cache as it is read
+        if not self.cache:
+            return responses
+        datarequest = DataRequest()
+        def cached():
+            try:
+                for eachReq, dataResponse in zip(bundleRequest, responses):
+                    self.cache.set(datarequest.encode_Request(eachReq[0], self.dataSource),
+                                   dataResponse, eachReq[0])
+                    yield dataResponse
+            finally:
+                if hasattr(responses, 'close'):
+                    responses.close()
+        return _ClosingResponses(cached(), responses)
+
+    def _get_bundle_chunk(self, bundleRequest, retName, dateIndex, decoder, timeout=None, output='frame'):
+        """Posts one GetDataBundle request and formats its responses,
+           or returns them as they are if output is None"""
+        dataResponses = self._post_bundle(bundleRequest, timeout)
+        names = [self._get_metadata(dataResponse) if retName or eachReq[1] else None
+                 for eachReq, dataResponse in zip(bundleRequest, dataResponses)]
+        if output is None:
+            return list(dataResponses)
+        formattedResp = self._format_bundle_response({'DataResponses': dataResponses}, dateIndex, decoder, output)
+        for df, eachNames in zip(formattedResp, names):
+            self._set_names(df, eachNames)
+        return formattedResp
+
+    def _update_bundles(self, frames, freq='', end=''):
+        """Returns (start, keys, bundle) for each start date of update_data,
+           where keys are the (frame position, ticker) of each request"""
+        import pandas as pd
+        from .DS_Frames import last_dates
+        #Group the fields to request by start date, then frame and instrument
+        groups = {}
+        for frameIdx, df in enumerate(frames):
+            if not isinstance(getattr(df, 'columns', None), pd.MultiIndex):
+                continue
+            hint = '|C' if df.columns.nlevels == 3 else ''
+            for col, start in last_dates(df).items():
+                fields = groups.setdefault(start, {}).setdefault((frameIdx, col[0] + hint), [])
+                if col[1] not in fields:
+                    fields.append(col[1])
+        bundles = []
+        for start, requests in sorted(groups.items()):
+            keys = list(requests)
+            bundles.append((start, keys, [self.post_user_request(ticker, requests[(frameIdx, ticker)], start, end, freq)
+                                          for frameIdx, ticker in keys]))
+        return bundles
+
+    def _merge_tails(self, updated, keys, tails):
+        """Appends the DataFrames of an update_data bundle to the frames they update"""
+        import pandas as pd
+        from .DS_Frames import merge_tail
+        for (frameIdx, ticker), tail in zip(keys, tails):
+            if isinstance(tail, pd.DataFrame):
+                updated[frameIdx] = merge_tail(updated[frameIdx], tail)
+
+    def _names_bundle(self, tickers, fields):
+        """Returns the requests of warm_names for the names the name cache does not hold"""
+        symbols, missingFields = self.nameCache.missing(tickers, fields)
+        if missingFields and not symbols:
+            #A datatype name comes with a request for some instrument
+            symbols = list(tickers[:1])
+        if not symbols:
+            return []
+        reqFields = missingFields if missingFields else ['NAME']
+        planner = RequestPlanner()
+        perRequest = max(1, min(planner.maxInstruments, planner.maxItems // len(reqFields)))
+        return [self.post_user_request(','.join(symbols[i:i + perRequest]) + '|N', reqFields, kind=0)
+                for i in range(0, len(symbols), perRequest)]
+
+    def _lookup_bundle(self, bundleRequest, retName, dateIndex, useCache, decoder, output='frame'):
+        """Returns (bundleRequest, names, formattedResp, missing) for get_bundle_data:
+           the requests with the names the name cache holds left out, the names of
+           each request, the results the store and cache hold, and the positions
+           of the requests to post"""
+        #Requests with retName or the N hint get their names, from the name
+        #cache if it holds them all
+        bundleRequest = [(eachReq[0], retName or eachReq[1]) for eachReq in bundleRequest]
+        names = [None] * len(bundleRequest)
+        if self.nameCache:
+            for pos, eachReq in enumerate(bundleRequest):
+                if eachReq[1]:
+                    names[pos] = self._known_names(eachReq[0])
+                    if names[pos] is not None:
+                        bundleRequest[pos] = (self._without_names(eachReq[0]), False)
+        formattedResp = [None] * len(bundleRequest)
+        missing = list(range(len(bundleRequest)))
+        if (self.cache or self.store) and useCache:
+            datarequest = DataRequest()
+            missing = []
+            for pos, eachReq in enumerate(bundleRequest):
+                if self.store and output == 'frame':
+                    formattedResp[pos] = self.store.get(eachReq[0], dateIndex)
+                    if formattedResp[pos] is not None:
+                        if self.metrics:
+                            self.metrics.count('storeHits')
+                        continue
+                dataResponse = self.cache.get(datarequest.encode_Request(eachReq[0], self.dataSource)) if self.cache else None
+                if self.cache and self.metrics:
+                    self.metrics.count('cacheMisses' if dataResponse is None else 'cacheHits')
+                if dataResponse is None:
+                    missing.append(pos)
+                    continue
+                if eachReq[1]:
+                    names[pos] = self._get_metadata(dataResponse)
+                formattedResp[pos] = (dataResponse if output is None else
+                                      self._format_Response(dataResponse, decoder, dateIndex, output))
+        return bundleRequest, names, formattedResp, missing
+
+    def _finish_bundle(self, formattedResp, names, combine, dateIndex, decoder):
+        """Returns the results of get_bundle_data with their names, or one DataFrame with combine"""
+        if combine:
+            return self._combine(formattedResp, combine, dateIndex, decoder)
+        for df, eachNames in zip(formattedResp, names):
+            self._set_names(df, eachNames)
+        return formattedResp
+
+    def _failed_chunk(self, exp, chunk):
+        """Returns a DatastreamError per request of a chunk that failed, for partial results"""
+        err = exp if isinstance(exp, DatastreamError) else DatastreamError(str(exp))
+        err.requests = chunk
+        return [err] * len(chunk)
+
+    def _combine(self, dataResponses, combine, dateIndex, decoder):
+        """Formats the DataResponses of get_bundle_data as one DataFrame"""
+        from .DS_Frames import combine_responses
+        failed = [resp for resp in dataResponses if isinstance(resp, DatastreamError)]
+        started = time.perf_counter()
+        df = combine_responses([resp for resp in dataResponses if isinstance(resp, dict)],
+                               combine, dateIndex, decoder)
+        if self.metrics:
+            self.metrics.record('format', time.perf_counter() - started)
+        if failed:
+            df.attrs['failed'] = failed
+        return df
+
+    def _post_bundle(self, bundleRequest, timeout=None):
+        """Posts one GetDataBundle request and returns its DataResponses"""
+        getDataBundle_url = self.url + "GetDataBundle"
+        datarequest = DataRequest()
+        json_Response = self._get_json_Response_token(getDataBundle_url,
+                            lambda token: datarequest.encode_bundle_Request(bundleRequest, self.dataSource, token), timeout)
+        #print(json_Response)
+        if 'DataResponses' in json_Response:
+            if self.cache:
+                for eachReq, dataResponse in zip(bundleRequest, json_Response['DataResponses']):
+                    self.cache.set(datarequest.encode_Request(eachReq[0], self.dataSource),
+                                   dataResponse, eachReq[0])
+            return json_Response['DataResponses']
+        else:
+            raise DatastreamError(json_Response.get('Message', "GetDataBundle returned no DataResponses"),
+                                  200, json_Response, bundleRequest)
+
+    def _get_Response(self, reqUrl, raw_request, stream=False, timeout=None):
+        try:
+            #convert raw request to json bytes before post
             jsonRequest = self._json_Request(raw_request)
-            
-            if self._sslCert:
-                http_Response = self.reqSession.post(reqUrl, json=jsonRequest,  proxies=self._proxy, verify = self._sslCert, timeout= self._timeout)
-            else:
-                http_Response = self.reqSession.post(reqUrl, json=jsonRequest,  proxies=self._proxy, verify = self.certfile, timeout= self._timeout)
-            return http_Response
+            headers = {'Content-Type': 'application/json'}
+            verify = self._sslCert if self._sslCert else self.certfile
+            metrics = self.metrics
+            started = time.perf_counter() if metrics else 0
+            attempt = 0
+            while True:
+                if metrics:
+                    metrics.count('requests')
+                    metrics.count('requestBytes', len(jsonRequest))
+                    if attempt:
+                        metrics.count('retries')
+                if self.rateLimiter:
+                    self.rateLimiter.acquire()
+                try:
+                    http_Response = self.reqSession.post(reqUrl, data=jsonRequest, headers=headers, proxies=self._proxy, verify = verify,
+                                                         timeout= timeout if timeout else self._timeout, stream=stream)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    if not self.retryPolicy.retry_error(attempt):
+                        raise
+                    time.sleep(self.retryPolicy.delay(attempt))
+                    attempt += 1
+                    continue
+                if self.retryPolicy.retry_status(attempt, http_Response.status_code):
+                    #Server errors and throttling are retried after a backoff or Retry-After
+                    delay = self.retryPolicy.delay(attempt, http_Response.headers.get('Retry-After'))
+                    http_Response.close()
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                if metrics:
+                    metrics.record('post', time.perf_counter() - started)
+                return http_Response
 
         except requests.exceptions.ConnectionError as conerr:
             print(conerr)
@@ -289,22 +942,72 @@ class Datastream:
             raise
 
         
-    def _get_json_Response(self, reqUrl, raw_request):
+    def _get_json_Response(self, reqUrl, raw_request, timeout=None):
+        """Posts the request and returns the decoded JSON response. Raises a
+           DatastreamError if DSWS does not return a valid response."""
         try:
-          httpResponse = self._get_Response(reqUrl, raw_request)
-          if httpResponse:
-              json_Response=dict(httpResponse.json()) if httpResponse.status_code==200 else None
-              return json_Response
-          else:
-              return None
-        except json.JSONDecodeError as jdecodeerr:
-            print("_get_json_Response : JSON decoder Exception Occured: " + jdecodeerr)
-            return None
-        except Exception as exp:
-            print("_get_json_Response : Exception Occured: ")
-            print(exp)
-            return None
+            httpResponse = self._get_Response(reqUrl, raw_request, timeout=timeout)
+        except requests.exceptions.RequestException as exp:
+            raise DatastreamError(str(exp), retryable=True) from exp
+        return self._decode_json_Response(httpResponse, httpResponse.content)
+
+    def _decode_json_Response(self, httpResponse, content):
+        """Decodes the body of a DSWS response. Raises a DatastreamError with
+           the Message of the response if its status is not 200."""
+        started = time.perf_counter() if self.metrics else 0
+        try:
+            json_Response = dict(loads(content))
+        except (ValueError, TypeError):
+            json_Response = None
+        if self.metrics:
+            self.metrics.record('decode', time.perf_counter() - started)
+            self.metrics.count('responseBytes', len(content))
+        if httpResponse.status_code != 200:
+            message = json_Response.get('Message') if json_Response else None
+            raise DatastreamError(message if message else "DSWS returned HTTP status %d" % httpResponse.status_code,
+                                  httpResponse.status_code, json_Response,
+                                  retryable=httpResponse.status_code in self.retryPolicy.statuses)
+        if json_Response is None:
+            raise DatastreamError("_get_json_Response : JSON decoder Exception Occured", httpResponse.status_code)
+        return json_Response
     
+    def _check_token(self):
+        """Refreshes the token if it is about to expire. Raises if no token
+           could be obtained, returns False if the response has no TokenValue"""
+        if self.tokenManager:
+            self.tokenResp = self.tokenManager.get()
+        if (self.tokenResp == None):
+            raise Exception("Invalid Token Value")
+        elif 'Message' in self.tokenResp.keys():
+            raise Exception(self.tokenResp['Message'])
+        return 'TokenValue' in self.tokenResp.keys()
+
+    def _get_json_Response_token(self, reqUrl, build_request, timeout=None):
+        """Posts the request built by build_request(token). If DSWS rejects
+           the token, gets a new one and posts the request once more"""
+        token = self.tokenResp['TokenValue']
+        try:
+            json_Response = self._get_json_Response(reqUrl, self._build_request(build_request, token), timeout)
+        except DatastreamError as err:
+            if not (self.tokenManager and is_token_error(err.response)):
+                raise
+            json_Response = err.response
+        if self.tokenManager and is_token_error(json_Response):
+            tokenResp = self.tokenManager.refresh(token)
+            if tokenResp and 'TokenValue' in tokenResp:
+                self.tokenResp = tokenResp
+                json_Response = self._get_json_Response(reqUrl, self._build_request(build_request, tokenResp['TokenValue']),
+                                                        timeout)
+        return json_Response
+
+    def _build_request(self, build_request, token):
+        if not self.metrics:
+            return build_request(token)
+        started = time.perf_counter()
+        raw_request = build_request(token)
+        self.metrics.record('build', time.perf_counter() - started)
+        return raw_request
+
     def _get_token(self, isProxy=False):
         token_url = self.url + "GetToken"
         try:
@@ -314,13 +1017,7 @@ class Datastream:
                 propties.append(Properties("Source", self.dataSource))
             tokenReq = TokenRequest(self.username, self.password, propties)
             raw_tokenReq = tokenReq.get_TokenRequest()
-            
-            #Load windows certificates to a local file
-            pf = platform.platform()
-            if pf.upper().startswith('WINDOWS'):
-                self._loadWinCerts()
-            else:
-                self.certfile = requests.certs.where()
+            self._load_certs()
 
             #Post the token request to get response in json format
             json_Response = self._get_json_Response(token_url, raw_tokenReq)
@@ -331,14 +1028,23 @@ class Datastream:
             print(traceback.print_exc(limit=2))
             return None
     
+    def _new_session(self):
+        #Keep-alive connections, enough for the worker threads to share
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self.poolConnections,
+                                                pool_maxsize=max(self.poolMaxsize, self.maxWorkers))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers['User-Agent'] = session.headers['User-Agent'] + ' DatastreamPy/1.0.11'
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+        return session
+
     def _json_Request(self, raw_text):
-        #convert the dictionary (raw text) to json text first
-        jsonText = json.dumps(raw_text)
-        byteTemp = bytes(jsonText,'utf-8')
-        byteTemp = jsonText.encode('utf-8')
-        #convert the json Text to json formatted Request
-        jsonRequest = json.loads(byteTemp)
-        return jsonRequest
+        #Requests already encoded by DataRequest are posted as they are
+        if isinstance(raw_text, bytes):
+            return raw_text
+        #convert the dictionary (raw text) to json bytes
+        return dumps(raw_text)
 
     def _get_Date(self, jsonDate):
         try:
@@ -347,6 +1053,7 @@ class Datastream:
             if match:
                 #d = re.search('[0-9]{13}', jsonDate)
                 d = float(match.group(2))
+                import pytz
                 ndate = datetime(1970,1,1) + timedelta(seconds=float(d)/1000)
                 utcdate = pytz.UTC.fromutc(ndate).strftime('%Y-%m-%d')
                 return utcdate
@@ -360,9 +1067,14 @@ class Datastream:
             
             
     
-    def _get_DatatypeValues(self, jsonResp):
-        df = pd.DataFrame()
+    def _get_DatatypeValues(self, jsonResp, decoder=None):
+        import pandas as pd
+        from .DS_Arrays import DateDecoder
+        from .DS_Frames import ColumnBuilder
+        decoder = decoder if decoder else DateDecoder()
+        columns = ColumnBuilder()
         multiIndex = False
+        currency = None
         valDict = {"Instrument":[],"Datatype":[],"Value":[],"Currency":[]}
         #print (jsonResp)
         for item in jsonResp['DataTypeValues']: 
@@ -383,25 +1095,22 @@ class Datastream:
                    colNames = (instrument, datatype)
                values = i['Value']
                valType = i['Type']
-               df[colNames] = None
+               columns.set_scalar(colNames, None)
                
                #Handling all possible types of data as per DSSymbolResponseValueType
                if valType in [7, 8, 10, 11, 12, 13, 14, 15, 16]:
                    #These value types return an array
                    #The array can be of double, int, string or Object
-                   rowCount = df.shape[0]
-                   valLen = len(values)
+                   #Check if the array of Object is JSON dates and convert
+                   values = decoder.convert(values)
                    #If no of Values is < rowcount, append None to values
-                   if rowCount > valLen:
-                       for i in range(rowCount - valLen):
-                            values.append(None)
-                  #Check if the array of Object is JSON dates and convert
-                   for x in range(0, valLen):
-                       values[x] = self._get_Date(values[x]) if str(values[x]).find('/Date(') != -1 else values[x] 
+                   rowCount = columns.rowCount
+                   if rowCount > len(values):
+                       values.extend([None] * (rowCount - len(values)))
                    #Check for number of values in the array. If only one value, put in valDict
                    if len(values) > 1:
                        multiIndex = True
-                       df[colNames] = values
+                       columns.set_values(colNames, values)
                    else:
                        multiIndex = False
                        valDict["Value"].append(values[0])   
@@ -412,20 +1121,18 @@ class Datastream:
                else:
                    if valType == 4:
                        #value type 4 return single JSON date value, which needs conversion
-                       values = self._get_Date(values) if str(values).find('/Date(') != -1 else values
+                       values = decoder.convert([values])[0]
                        valDict["Value"].append(values)
                        multiIndex = False
                    elif valType == 9:
                        #value type 9 return array of JSON date values, needs conversion
-                       date_array = []
+                       #Values that are not JSON dates are dropped
+                       date_array = decoder.decode([x for x in values if type(x) is str and '/Date(' in x])
                        if len(values) > 1:
                           multiIndex = True
-                          for eachVal in values:
-                              date_array.append(self._get_Date(eachVal)) if str(eachVal).find('/Date(') != -1 else eachVal 
-                          df[colNames] = date_array
+                          columns.set_values(colNames, date_array)
                        else:
                           multiIndex = False
-                          date_array.append(self._get_Date(values[0])) if str(values[0]).find('/Date(') != -1 else values[0]
                           valDict["Value"].append(date_array[0])
                    else:
                        if valType == 0:
@@ -433,12 +1140,10 @@ class Datastream:
                            #12/12/2019 - Error returned can be array or a single 
                            #multiIndex = False
                            valDict["Value"].append(values)
-                           df[colNames] = values
-               if multiIndex:
-                   if currency:
-                        df.columns = pd.MultiIndex.from_tuples(df.columns, names=['Instrument','Field','Currency'])
-                   else:
-                        df.columns = pd.MultiIndex.from_tuples(df.columns, names=['Instrument','Field'])
+                           if isinstance(values, list):
+                               columns.set_values(colNames, values)
+                           else:
+                               columns.set_scalar(colNames, values)
                    
         if not multiIndex:
             indexLen = range(len(valDict['Instrument']))
@@ -449,22 +1154,47 @@ class Datastream:
                 newdf = pd.DataFrame(data=valDict,columns=["Instrument", "Datatype", "Value"],
                                  index=indexLen)
             return newdf
-        return df 
+        #Build the frame once with all the columns collected above
+        if currency:
+            return columns.build(['Instrument','Field','Currency'])
+        return columns.build(['Instrument','Field'])
             
-    def _format_Response(self, response_json):
+    def _format_Response(self, response_json, decoder=None, dateIndex=False, output='frame'):
+        if not self.metrics:
+            return self._format_DataResponse(response_json, decoder, dateIndex, output)
+        started = time.perf_counter()
+        formatted = self._format_DataResponse(response_json, decoder, dateIndex, output)
+        self.metrics.record('format', time.perf_counter() - started)
+        symbols = 0
+        values = 0
+        for item in response_json.get('DataTypeValues') or []:
+            for symVal in item['SymbolValues']:
+                symbols += 1
+                values += len(symVal['Value']) if isinstance(symVal['Value'], list) else 1
+        self.metrics.count('responses')
+        self.metrics.count('symbols', symbols)
+        self.metrics.count('values', values)
+        return formatted
+
+    def _format_DataResponse(self, response_json, decoder=None, dateIndex=False, output='frame'):
         # If dates is not available, the request is not constructed correctly
+        from .DS_Arrays import DateDecoder, format_arrays
         response_json = dict(response_json)
+        decoder = decoder if decoder else DateDecoder()
+        if output == 'typed':
+            from .DS_Frames import format_typed
+            return format_typed(response_json, decoder, dateIndex)
+        if output != 'frame':
+            if output not in ('numpy', 'records'):
+                raise ValueError("output must be 'frame', 'typed', 'numpy' or 'records'")
+            return format_arrays(response_json, decoder, output)
         if 'Dates' in response_json:
-            dates_converted = []
-            if response_json['Dates'] != None:
-                dates = response_json['Dates']
-                for d in dates:
-                    dates_converted.append(self._get_Date(d))
+            dates_converted = decoder.decode(response_json['Dates'], dateIndex)
         else:
             return 'Error - please check instruments and parameters (time series or static)'
         
         # Loop through the values in the response
-        dataframe = self._get_DatatypeValues(response_json)
+        dataframe = self._get_DatatypeValues(response_json, decoder)
         if (len(dates_converted) == len(dataframe.index)):
             if (len(dates_converted) > 1):
                 #dataframe.insert(loc = 0, column = 'Dates', value = dates_converted)
@@ -475,14 +1205,25 @@ class Datastream:
         
         return dataframe
 
-    def _format_bundle_response(self,response_json):
+    def _format_bundle_response(self,response_json, dateIndex=False, decoder=None, output='frame'):
+       from .DS_Arrays import DateDecoder
        formattedResp = []
+       #Dates repeated across the responses are decoded once
+       decoder = decoder if decoder else DateDecoder()
        for eachDataResponse in response_json['DataResponses']:
-           df = self._format_Response(eachDataResponse)
+           df = self._format_Response(eachDataResponse, decoder, dateIndex, output)
            formattedResp.append(df)      
            
        return formattedResp
    
+    def _load_certs(self):
+        #Load windows certificates to a local file
+        pf = platform.platform()
+        if pf.upper().startswith('WINDOWS'):
+            self._loadWinCerts()
+        else:
+            self.certfile = requests.certs.where()
+
     def _loadWinCerts(self):
         import wincertstore
         cfile = wincertstore.CertFile()
@@ -494,19 +1235,94 @@ class Datastream:
         #print(self.certfile.name)
         
     def _get_metadata(self, jsonResp):
-        names = {}
-        if jsonResp['SymbolNames']:
-            for i in jsonResp['SymbolNames']:
-                names.update({i['Key']: i['Value']})
-                
-        if jsonResp['DataTypeNames']:
-            for i in jsonResp['DataTypeNames']:
-                names.update({i['Key']: i['Value']})
-        
-        print(names)
+        """Returns the SymbolNames and DataTypeNames of a response as
+           dictionaries of code to name, and adds them to the name cache"""
+        names = {'SymbolNames': {}, 'DataTypeNames': {}}
+        for kind in names:
+            for i in jsonResp.get(kind) or []:
+                names[kind][i['Key']] = i['Value']
+        if self.nameCache:
+            self.nameCache.update(names)
+        return names
         
     def _get_metadata_bundle(self, jsonResp):
-        for eachDataResponse in jsonResp:
-            self._get_metadata(eachDataResponse)
+        return [self._get_metadata(eachDataResponse) for eachDataResponse in jsonResp]
+
+    def _set_names(self, df, names):
+        #The names are kept with the DataFrame they describe
+        if names is not None and hasattr(df, 'attrs'):
+            df.attrs['names'] = names
+
+    def _known_names(self, req):
+        """Returns the names of the request's instruments and datatypes from
+           the name cache, or None if it does not hold them all"""
+        hints = [getattr(prop, 'Key', None) for prop in req["Instrument"].properties or []]
+        fields = [eachDtype.datatype for eachDtype in req["DataTypes"]]
+        #Lists and expressions return other symbols than the ones requested
+        if not set(hints) <= {'N', 'C'} or not fields or not all(isinstance(f, str) and f for f in fields):
+            return None
+        symbols = [s.strip() for s in req["Instrument"].instrument.split(',')]
+        if any(self.nameCache.missing(symbols, fields)):
+            return None
+        return self.nameCache.lookup(symbols, fields)
+
+    def _without_names(self, req):
+        """Returns a copy of the request without ReturnName"""
+        props = [prop for prop in req["Instrument"].properties or [] if getattr(prop, 'Key', None) != 'N']
+        return {"Instrument": Instrument(req["Instrument"].instrument, props or None),
+                "DataTypes": [DataType(eachDtype.datatype) for eachDtype in req["DataTypes"]],
+                "Date": req["Date"]}
 #-------------------------------------------------------------------------------------
 
+#The start of a GetDataBundle body whose DataResponses can be streamed
+_dataResponsesStart = re.compile(rb'^\s*\{\s*"DataResponses"\s*:')
+
+class _ClosingResponses(object):
+    """Iterator over the DataResponses of a generator that also closes their
+       source, such as the streamed response, when it is closed. Closing a
+       generator that was never started does not run its finally block."""
+
+    def __init__(self, responses, source):
+        self._responses = responses
+        self._source = source
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._responses)
+
+    def close(self):
+        try:
+            self._responses.close()
+        finally:
+            self._source.close()
+
+class _BodyReader(object):
+    """File-like reader of a streamed response body that can look at its start
+       before it is parsed, and counts the bytes read"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.size = 0
+        self._head = b''
+
+    def starts_with(self, pattern, length=64):
+        #A decompressed read can return fewer bytes than asked for
+        while len(self._head) < length:
+            data = self.raw.read(length - len(self._head))
+            if not data:
+                break
+            self._head += data
+        return pattern.match(self._head) is not None
+
+    def read(self, size=-1):
+        head, self._head = self._head, b''
+        if size is None or size < 0:
+            data = head + self.raw.read()
+        elif len(head) >= size:
+            data, self._head = head[:size], head[size:]
+        else:
+            data = head + self.raw.read(size - len(head))
+        self.size += len(data)
+        return data
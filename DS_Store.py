@@ -0,0 +1,245 @@
+import json
+import os
+import threading
+from datetime import date
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+from .DS_Frames import to_wide
+from .DS_Requests import dumps
+from .DS_Utils import write_atomic, parse_date
+
+#--------------------------------------------------------------------------------
+class SeriesStore(object):
+    """Local store of the DataFrames returned by get_data and get_bundle_data,
+       read back through memory mapped Arrow files. Requires pyarrow.
+
+       Each series is one Arrow IPC file, partitioned as
+       folder/<frequency>/<instrument>/<field>.arrow, and index.json records
+       the dates each series covers. A request is served from the store when
+       every one of its series covers its start and end dates. Requests with
+       relative dates, such as -1Y, and instrument lists are always sent to DSWS."""
+    indexFile = 'index.json'
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self.index = self._read_index()
+
+    def get(self, req, dateIndex=False):
+        """Returns the DataFrame for the post_user_request request req as
+           get_data would format it, or None if the store does not cover it"""
+        df = None
+        spec = self._spec(req)
+        if spec:
+            symbols, fields, freq, currency, start, end = spec
+            entries = []
+            for field in fields:
+                for symbol in symbols:
+                    entry = self.index.get(self._key(freq, symbol, field))
+                    if (entry is None or entry['start'] > start or entry['end'] < end
+                            or (currency and entry['currency'] is None)):
+                        entries = None
+                        break
+                    entries.append(entry)
+                if entries is None:
+                    break
+            if entries:
+                df = self._build(entries, start, end, currency, dateIndex)
+        with self._lock:
+            if df is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return df
+
+    def put(self, req, df):
+        """Stores the DataFrame that get_data or get_bundle_data returned for
+           the post_user_request request req. Returns True if it was stored."""
+        if not isinstance(df, pd.DataFrame) or len(df.index) == 0:
+            return False
+        wide = to_wide(df)
+        if not isinstance(wide.columns, pd.MultiIndex) or req["Date"].Kind not in (0, 1):
+            return False
+        if any('L' == getattr(prop, 'Key', None) for prop in req["Instrument"].properties or []):
+            return False
+        try:
+            dates = pd.DatetimeIndex(wide.index).values.astype('datetime64[D]')
+            freq = self._freq(req)
+            if req["Date"].Kind == 0:
+                #A static response holds the values of a single date
+                start = end = str(dates[0])
+            else:
+                start = self._parse_date(req["Date"].Start) or str(dates[0])
+                end = self._parse_date(req["Date"].End)
+                if end is None or end > str(dates[-1]) and end >= date.today().isoformat():
+                    end = str(dates[-1])
+            with self._lock:
+                self.index = self._read_index()
+                for col in wide.columns:
+                    self._put_series(freq, col, dates, wide[col], start, end)
+                self._write_index()
+            return True
+        except Exception as exp:
+            print("SeriesStore : could not store the data: " + str(exp))
+            return False
+
+    def stats(self):
+        """Returns the hit and miss counters"""
+        return {'hits': self.hits, 'misses': self.misses}
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+    def _spec(self, req):
+        #The series, dates and currency of a request, or None if it cannot be served
+        dt = req["Date"]
+        hints = [getattr(prop, 'Key', None) for prop in req["Instrument"].properties or []]
+        fields = [eachDtype.datatype for eachDtype in req["DataTypes"]]
+        if 'L' in hints or dt.Kind not in (0, 1) or not all(isinstance(f, str) and f for f in fields):
+            return None
+        start = self._parse_date(dt.Start)
+        end = start if dt.Kind == 0 else self._parse_date(dt.End)
+        if start is None or end is None or start > end:
+            return None
+        symbols = [s.strip() for s in req["Instrument"].instrument.split(',')]
+        return symbols, fields, self._freq(req), 'C' in hints, start, end
+
+    def _freq(self, req):
+        if req["Date"].Kind == 0:
+            return 'static'
+        return (req["Date"].Frequency or 'D').upper()
+
+    def _key(self, freq, symbol, field):
+        return '|'.join([freq, symbol.upper(), field.upper()])
+
+    def _parse_date(self, text):
+        #Absolute dates as YYYY-MM-DD, which the index compares as strings
+        parsed = parse_date(text)
+        return parsed.strftime('%Y-%m-%d') if parsed else None
+
+    def _put_series(self, freq, col, dates, values, start, end):
+        import pyarrow as pa
+        symbol, field = col[0], col[1]
+        currency = col[2] if len(col) > 2 else None
+        key = self._key(freq, symbol, field)
+        entry = self.index.get(key)
+        path = os.path.join(freq, quote(symbol.upper(), safe=''), quote(field.upper(), safe='') + '.arrow')
+        if entry and entry['start'] <= end and entry['end'] >= start:
+            #Overlapping ranges are merged, the new values replace the stored ones
+            old = self._read_table(entry['file'])
+            oldDates = old.column('Dates').to_numpy()
+            keep = (oldDates < np.datetime64(start)) | (oldDates > np.datetime64(end))
+            if keep.any():
+                kept = old.filter(pa.array(keep))
+                values = pd.concat([pd.Series(self._values(kept.column('Value'), kept.schema.field('Value')),
+                                              index=oldDates[keep]),
+                                    pd.Series(values.array, index=dates)]).sort_index(kind='stable')
+                dates = values.index.values.astype('datetime64[D]')
+            start = min(start, entry['start'])
+            end = max(end, entry['end'])
+            currency = currency if currency is not None else entry['currency']
+        table = self._table(dates, values)
+        if table is None:
+            return
+        self._write_table(path, table)
+        self.index[key] = {'symbol': symbol, 'field': field, 'currency': currency, 'file': path,
+                           'start': start, 'end': end, 'rows': table.num_rows}
+
+    def _table(self, dates, values):
+        #The Arrow table of a series, or None if its values cannot be stored as they are
+        import pyarrow as pa
+        valField = pa.field('Value', pa.float64())
+        if values.dtype == np.float64:
+            #NaN stays a float so the column reads back without a null mask
+            valArray = pa.array(values.to_numpy(), type=pa.float64())
+        else:
+            try:
+                valArray = pa.array(values.tolist(), from_pandas=True)
+                valField = pa.field('Value', valArray.type)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                #Mixed values, such as None, 'NA' and numbers in an object array, are kept as JSON
+                try:
+                    valArray = pa.array([json.dumps(v) for v in values.tolist()], type=pa.string())
+                except (TypeError, ValueError):
+                    return None
+                valField = pa.field('Value', pa.string(), metadata={'encoding': 'json'})
+        schema = pa.schema([pa.field('Dates', pa.date32()), valField])
+        return pa.Table.from_arrays([pa.array(dates, type=pa.date32()), valArray], schema=schema)
+
+    def _values(self, column, field):
+        #The values of a Value column, decoding the JSON of mixed values
+        import pyarrow as pa
+        if pa.types.is_floating(column.type):
+            return column.to_numpy().copy()
+        if field.metadata and field.metadata.get(b'encoding') == b'json':
+            #An object array, so values that happen to be all strings are not inferred as str
+            decoded = np.empty(len(column), dtype=object)
+            for pos, text in enumerate(column.to_pylist()):
+                decoded[pos] = json.loads(text)
+            return decoded
+        return column.to_pylist()
+
+    def _read_table(self, path):
+        import pyarrow as pa
+        with pa.memory_map(os.path.join(self.folder, path), 'r') as source:
+            return pa.ipc.open_file(source).read_all()
+
+    def _write_table(self, path, table):
+        import pyarrow as pa
+        fullPath = os.path.join(self.folder, path)
+        os.makedirs(os.path.dirname(fullPath), exist_ok=True)
+        def write(f):
+            with pa.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+        write_atomic(fullPath, write)
+
+    def _build(self, entries, start, end, currency, dateIndex):
+        import pyarrow as pa
+        columns = []
+        keys = []
+        for entry in entries:
+            with pa.memory_map(os.path.join(self.folder, entry['file']), 'r') as source:
+                table = pa.ipc.open_file(source).read_all()
+                #Only the requested dates are copied out of the memory map
+                dates = table.column('Dates').to_numpy()
+                lo = np.searchsorted(dates, np.datetime64(start), side='left')
+                hi = np.searchsorted(dates, np.datetime64(end), side='right')
+                values = self._values(table.column('Value').slice(lo, hi - lo), table.schema.field('Value'))
+                columns.append(pd.Series(values, index=pd.DatetimeIndex(dates[lo:hi].astype('datetime64[s]'))))
+            keys.append((entry['symbol'], entry['field'], entry['currency'] or 'NA') if currency
+                        else (entry['symbol'], entry['field']))
+        df = pd.concat(columns, axis=1) if len(columns) > 1 else columns[0].to_frame()
+        if len(df.index) == 0:
+            return None
+        dates = df.index if dateIndex else pd.Index(df.index.strftime('%Y-%m-%d'))
+        if len(df.index) == 1:
+            #A single date is formatted as a row per instrument and field
+            valDict = {"Instrument": [key[0] for key in keys], "Datatype": [key[1] for key in keys],
+                       "Value": [df.iat[0, pos] for pos in range(len(keys))]}
+            names = ["Instrument", "Datatype", "Value"]
+            if currency:
+                valDict["Currency"] = [key[2] for key in keys]
+                names.append("Currency")
+            longDf = pd.DataFrame(data=valDict, columns=names, index=range(len(keys)))
+            if len(keys) != 1:
+                longDf['Dates'] = dates[0]
+            return longDf
+        df.index = dates
+        df.index.name = 'Dates'
+        df.columns = pd.MultiIndex.from_tuples(keys, names=['Instrument', 'Field', 'Currency'] if currency
+                                               else ['Instrument', 'Field'])
+        return df
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.folder, self.indexFile), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self):
+        write_atomic(os.path.join(self.folder, self.indexFile), dumps(self.index))
@@ -0,0 +1,233 @@
+import gzip
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .DS_Requests import dumps, loads
+
+#--------------------------------------------------------------------------------
+class StubServer(object):
+    """Local stand-in for the DSWS GetToken, GetData and GetDataBundle
+       endpoints, to measure Datastream without a connection to DSWS.
+
+       Point a client at it with [url] path=<server.url> in the config, or
+       set its url. Synthetic timeseries responses have an array of dates
+       values per instrument and field, with field i of the Type
+       valueTypes[i % len(valueTypes)]; static responses (kind 0) have single
+       values of the Types staticTypes. seriesTypes and singleTypes cover
+       every Type that _get_DatatypeValues handles.
+
+       With recorded, a DiskCache folder filled by a live client with a
+       CachePolicy that never expires, the recorded DataResponse of each
+       request is returned instead, falling back to a synthetic one.
+
+           server = StubServer(dates=250, valueTypes=StubServer.seriesTypes).start()
+           ...
+           server.stop()"""
+    #DSSymbolResponseValueType codes of arrays and of single values, with errors
+    seriesTypes = (10, 16, 8, 14, 7, 13, 11, 12, 9, 15, 0)
+    singleTypes = (5, 3, 2, 1, 6, 4, 0)
+    errorValue = '$$"ER", E100,INVALID CODE OR EXPRESSION ENTERED'
+
+    def __init__(self, dates=250, valueTypes=None, staticTypes=None, recorded=None, latency=0,
+                 compress=False, host='127.0.0.1', port=0, seed=0):
+        self.dates = dates
+        self.valueTypes = tuple(valueTypes) if valueTypes else (10,)
+        self.staticTypes = tuple(staticTypes) if staticTypes else (5,)
+        self.recorded = recorded
+        self.latency = latency
+        self.compress = compress
+        self.host = host
+        self.port = port
+        self.seed = seed
+        self.requests = 0
+        self._columns = {}
+        self._recordings = None
+        self._lock = threading.Lock()
+        self._server = None
+        self._process = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % (self.host, self.port)
+
+    def start(self, process=False):
+        """Starts serving from a daemon thread, or from a separate process if
+           process is True so the server does not compete with the client for
+           the GIL. A script starting a process must do so under
+           if __name__ == '__main__'. Returns the server."""
+        if process:
+            import multiprocessing
+            context = multiprocessing.get_context('spawn')
+            parentConn, childConn = context.Pipe()
+            settings = dict(dates=self.dates, valueTypes=self.valueTypes, staticTypes=self.staticTypes,
+                            recorded=self.recorded,
+                            latency=self.latency, compress=self.compress, host=self.host,
+                            port=self.port, seed=self.seed)
+            self._process = context.Process(target=_serve_process, args=(settings, childConn), daemon=True)
+            self._process.start()
+            self.port = parentConn.recv()
+            return self
+        self._server = ThreadingHTTPServer((self.host, self.port), _handler(self))
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stops the server"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._process:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def respond(self, path, body):
+        """Returns the JSON response to a request body posted to path"""
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if path.endswith('GetToken'):
+            expiry = int((time.time() + 86400) * 1000)
+            return {'TokenValue': 'StubToken', 'TokenExpiry': '/Date(%d+0000)/' % expiry, 'Properties': None}
+        if path.endswith('GetDataBundle'):
+            return {'DataResponses': [self.data_response(dataReq, body.get('Properties'))
+                                      for dataReq in body['DataRequests']], 'Properties': None}
+        if path.endswith('GetData'):
+            return {'DataResponse': self.data_response(body['DataRequest'], body.get('Properties')),
+                    'Properties': None}
+        return {'Message': 'Unknown endpoint ' + path}
+
+    def data_response(self, dataReq, properties=None):
+        """Returns the DataResponse to one DataRequest"""
+        if self.recorded:
+            recording = self._recorded(dataReq, properties)
+            if recording is not None:
+                return recording
+        instProps = [prop['Key'] for prop in dataReq['Instrument'].get('Properties') or []]
+        symbols = dataReq['Instrument']['Value'].split(',')
+        fields = [dtype['Value'] for dtype in dataReq['DataTypes']] or ['P']
+        static = dataReq['Date']['Kind'] == 0
+        dates, valueTypes = (1, self.staticTypes) if static else (self.dates, self.valueTypes)
+        dtValues = []
+        for pos, field in enumerate(fields):
+            valueType = valueTypes[pos % len(valueTypes)]
+            value = self._column(valueType, dates)
+            symValues = []
+            for symbol in symbols:
+                symVal = {'Currency': None, 'Symbol': symbol, 'Type': valueType, 'Value': value}
+                if 'ReturnCurrency' in instProps:
+                    symVal['Currency'] = 'U$'
+                else:
+                    del symVal['Currency']
+                symValues.append(symVal)
+            dtValues.append({'DataType': field, 'SymbolValues': symValues})
+        returnName = 'ReturnName' in instProps
+        return {'AdditionalResponses': [{'Key': 'Frequency', 'Value': dataReq['Date']['Frequency'] or 'D'}],
+                'DataTypeNames': [{'Key': f, 'Value': f + ' NAME'} for f in fields] if returnName else None,
+                'DataTypeValues': dtValues,
+                'Dates': self._column(9, dates),
+                'SymbolNames': [{'Key': s, 'Value': s + ' NAME'} for s in symbols] if returnName else None,
+                'Tag': None}
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+    def _column(self, valueType, dates):
+        #The values of a Type are generated once and shared by every symbol
+        key = (valueType, dates)
+        column = self._columns.get(key)
+        if column is None:
+            column = self._columns[key] = _values(valueType, dates, random.Random(self.seed + valueType))
+        return column
+
+    def _recorded(self, dataReq, properties):
+        #Datastream caches a response under its request encoded without the token
+        if self._recordings is None:
+            from .DS_Cache import DiskCache
+            self._recordings = DiskCache(self.recorded)
+        key = dumps({'DataRequest': dataReq, 'Properties': properties, 'TokenValue': ''})
+        try:
+            #Recordings are replayed however old they are
+            with open(self._recordings._path(key), 'rb') as f:
+                return loads(f.read())['Response']
+        except (OSError, ValueError, KeyError):
+            return None
+
+#--------------------------------------------------------------------------------
+def _json_date(dt):
+    ms = int((dt - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return "/Date(%d+0000)/" % ms
+
+def _values(valueType, dates, rnd):
+    #A column of dates values of a DSSymbolResponseValueType
+    start = datetime(2000, 1, 3)
+    nullable = valueType in (13, 14, 15, 16)
+    if valueType in (10, 16):
+        values = [round(rnd.random() * 100, 4) for d in range(dates)]
+    elif valueType in (8, 14):
+        values = [rnd.randrange(1000000) for d in range(dates)]
+    elif valueType in (7, 13):
+        values = [rnd.random() < 0.5 for d in range(dates)]
+    elif valueType in (9, 15):
+        values = [_json_date(start + timedelta(days=d)) for d in range(dates)]
+    elif valueType == 11:
+        values = ['S%d' % rnd.randrange(1000) for d in range(dates)]
+    elif valueType == 12:
+        values = [rnd.choice([1.5, 2, 'NA', None]) for d in range(dates)]
+    elif valueType == 0:
+        return StubServer.errorValue
+    elif valueType == 1:
+        return None
+    elif valueType == 2:
+        return rnd.random() < 0.5
+    elif valueType == 3:
+        return rnd.randrange(1000000)
+    elif valueType == 4:
+        return _json_date(start)
+    elif valueType == 5:
+        return round(rnd.random() * 100, 4)
+    elif valueType == 6:
+        return 'NAME'
+    else:
+        raise ValueError("Unknown value type %r" % valueType)
+    if nullable and dates > 1:
+        for d in range(0, dates, 10):
+            values[d] = None
+    return values
+
+def _handler(stub):
+    class _Handler(BaseHTTPRequestHandler):
+        #Keep connections alive as DSWS does, without delaying the body behind the headers
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            try:
+                body = loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                status, response = 200, stub.respond(self.path, body)
+            except Exception as exp:
+                status, response = 400, {'Message': str(exp)}
+            data = dumps(response)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            if stub.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                data = gzip.compress(data, 1)
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+    return _Handler
+
+def _serve_process(settings, conn):
+    stub = StubServer(**settings).start()
+    conn.send(stub.port)
+    while True:
+        time.sleep(3600)
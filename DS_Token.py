@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from .DS_Requests import dumps
+from .DS_Utils import write_atomic
+
+_jsonDate = re.compile(r"/Date\((-?\d+)")
+
+#--------------------------------------------------------------------------------
+def token_expiry(tokenResp):
+    """Returns the TokenExpiry of a GetToken response in epoch seconds,
+       or None if the response has no expiry"""
+    if not tokenResp or not tokenResp.get('TokenExpiry'):
+        return None
+    match = _jsonDate.search(str(tokenResp['TokenExpiry']))
+    return int(match.group(1)) / 1000.0 if match else None
+
+def is_token_error(json_Response):
+    """True if a DSWS response rejected the request's token"""
+    if not isinstance(json_Response, dict):
+        return False
+    fault = ' '.join(str(json_Response.get(key, '')) for key in ('Code', 'SubCode', 'Message'))
+    return 'token' in fault.lower()
+
+#--------------------------------------------------------------------------------
+class TokenManager(object):
+    """Keeps a valid DSWS token for a Datastream client.
+
+       The token is refreshed refreshMargin seconds before its TokenExpiry.
+       Threads that need a new token at the same time share one GetToken
+       request. With a cacheFile, processes on the same host share the
+       token through the file instead of each requesting their own."""
+    #Seconds before expiry at which the token is refreshed
+    refreshMargin = 300
+    #Seconds before a failed GetToken is tried again
+    failureDelay = 30
+
+    def __init__(self, fetch, cacheFile=None, cacheKey=""):
+        self.fetch = fetch
+        self.cacheFile = cacheFile
+        self.cacheKey = hashlib.sha256(cacheKey.encode('utf-8')).hexdigest()
+        self.tokenResp = None
+        self._failedAt = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns a GetToken response that is not about to expire"""
+        if self._is_fresh(self.tokenResp):
+            return self.tokenResp
+        with self._lock:
+            if self._is_fresh(self.tokenResp):
+                return self.tokenResp
+            cached = self._read_cache()
+            if self._is_fresh(cached):
+                self.tokenResp = cached
+                return cached
+            return self._fetch()
+
+    def refresh(self, staleToken):
+        """Replaces a token that DSWS rejected. Returns the new GetToken response"""
+        with self._lock:
+            current = self.tokenResp.get('TokenValue') if self.tokenResp else None
+            if current and current != staleToken:
+                #Another thread has already refreshed it
+                return self.tokenResp
+            cached = self._read_cache()
+            if self._is_fresh(cached) and cached.get('TokenValue') != staleToken:
+                self.tokenResp = cached
+                return cached
+            return self._fetch()
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+    def _fetch(self):
+        self.tokenResp = self.fetch()
+        if self.tokenResp and 'TokenValue' in self.tokenResp:
+            self._failedAt = None
+            self._write_cache(self.tokenResp)
+        else:
+            self._failedAt = time.time()
+        return self.tokenResp
+
+    def _is_fresh(self, tokenResp):
+        if not tokenResp:
+            return False
+        if 'TokenValue' not in tokenResp:
+            #Keep a failed response for a while rather than retry on every call
+            return self._failedAt is not None and time.time() - self._failedAt < self.failureDelay
+        expiry = token_expiry(tokenResp)
+        return expiry is None or time.time() < expiry - self.refreshMargin
+
+    def _read_cache(self):
+        if not self.cacheFile:
+            return None
+        try:
+            with open(self.cacheFile, 'r') as f:
+                return json.load(f).get(self.cacheKey)
+        except (OSError, ValueError):
+            return None
+
+    def _write_cache(self, tokenResp):
+        if not self.cacheFile:
+            return
+        try:
+            try:
+                with open(self.cacheFile, 'r') as f:
+                    tokens = json.load(f)
+            except (OSError, ValueError):
+                tokens = {}
+            tokens[self.cacheKey] = tokenResp
+            write_atomic(self.cacheFile, dumps(tokens))
+        except OSError as exp:
+            print("TokenManager : could not write token cache: " + str(exp))
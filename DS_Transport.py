@@ -0,0 +1,103 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+#--------------------------------------------------------------------------------
+class DatastreamError(Exception):
+    """Error of a DSWS request that failed after its retries.
+
+       Attributes:
+           status: HTTP status code, or None if no response was received
+           response: the decoded JSON error response, if any
+           requests: the post_user_request requests that failed, when known
+           retryable: True if the request could succeed if sent again"""
+
+    def __init__(self, message, status=None, response=None, requests=None, retryable=False):
+        Exception.__init__(self, message)
+        self.status = status
+        self.response = response
+        self.requests = requests
+        self.retryable = retryable
+
+#--------------------------------------------------------------------------------
+class RetryPolicy(object):
+    """Exponential backoff with jitter for failed DSWS requests.
+
+       Args:
+           retries: number of times a request is sent again
+           backoff: delay in seconds before the first retry, doubled each time
+           maxBackoff: upper limit of the delay
+           statuses: HTTP status codes that are retried"""
+
+    def __init__(self, retries=3, backoff=0.5, maxBackoff=30, statuses=(429, 500, 502, 503, 504)):
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.statuses = statuses
+
+    def retry_status(self, attempt, status):
+        """True if a response with this status should be retried"""
+        return attempt < self.retries and status in self.statuses
+
+    def retry_error(self, attempt):
+        """True if a connection error or timeout should be retried"""
+        return attempt < self.retries
+
+    def delay(self, attempt, retryAfter=None):
+        """Seconds to wait before the next attempt. A Retry-After header from
+           the server takes precedence over the backoff."""
+        wait = _parse_retry_after(retryAfter)
+        if wait is not None:
+            return min(wait, self.maxBackoff)
+        #Full jitter: a random delay up to the exponential backoff
+        return random.uniform(0, min(self.maxBackoff, self.backoff * (2 ** attempt)))
+
+#--------------------------------------------------------------------------------
+class RateLimiter(object):
+    """Token bucket limiting the requests sent to DSWS to rate per second,
+       with bursts of up to burst requests. One limiter can be shared by
+       the threads and Datastream clients of a process."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst else max(1, rate))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Takes a token and returns the seconds to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """Blocks until a request can be sent"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+#--------------------HELPER FUNCTIONS--------------------------------------
+def _parse_retry_after(value):
+    #Retry-After is either a number of seconds or an HTTP date
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retryDate = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if retryDate.tzinfo is None:
+        retryDate = retryDate.replace(tzinfo=timezone.utc)
+    return max(0.0, (retryDate - datetime.now(timezone.utc)).total_seconds())
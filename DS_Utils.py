@@ -0,0 +1,39 @@
+import os
+import tempfile
+from datetime import datetime
+
+#--------------------------------------------------------------------------------
+def write_atomic(path, data):
+    """Writes data, bytes or a function that writes to a binary file, to a
+       temporary file next to path and swaps it in, so readers never see a
+       partial file"""
+    fd, tmpName = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if callable(data):
+                data(f)
+            else:
+                f.write(data)
+        os.replace(tmpName, path)
+    except BaseException:
+        try:
+            os.remove(tmpName)
+        except OSError:
+            pass
+        raise
+
+#--------------------------------------------------------------------------------
+#Formats of the absolute dates of a Date. Other dates, such as -1Y or
+#LATESTDATE, are relative and move with time.
+dateFormats = ['%Y-%m-%d', '%Y%m%d']
+
+def parse_date(text):
+    """Returns the datetime of an absolute start or end date, or None for
+       an empty or relative date"""
+    text = str(text).strip()
+    for fmt in dateFormats:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None